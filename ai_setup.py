@@ -1,14 +1,16 @@
 import os
 from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
+from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
-from langchain_anthropic import ChatAnthropic
+from python_api.history import TokenBudgetMemory
+from python_api.llm_client import LLM_VERBOSE, create_llm
+from python_api.metrics import record_tokens
 
 # Set up environment variable for API key
 os.environ["ANTHROPIC_API_KEY"] = "your_api_key_here"
 
-# Initialize the ChatAnthropic model
-llm = ChatAnthropic(model="claude-3-sonnet-20240229")
+# Initialize the ChatAnthropic model, on the shared connection pool
+llm = create_llm(on_usage=record_tokens)
 
 # Define the conversation template
 template = """
@@ -57,21 +59,72 @@ Chatbot:"""
 prompt = PromptTemplate(
     input_variables=["chat_history", "human_input"], template=template
 )
-memory = ConversationBufferMemory(memory_key="chat_history")
+# Keeps recent turns verbatim and folds older ones into a running summary
+memory = TokenBudgetMemory(llm=llm, memory_key="chat_history")
 
 # Create the LLMChain
 llm_chain = LLMChain(
     llm=llm,
     prompt=prompt,
-    verbose=True,
+    verbose=LLM_VERBOSE,
     memory=memory,
 )
 
+# Prompt used to summarize a conversation
+summary_prompt = PromptTemplate(
+    input_variables=["conversation"],
+    template="Please provide a brief summary of the following conversation, highlighting the main topics discussed and any key insights or recommendations:\n\n{conversation}\n\nSummary:"
+)
+
+# Prompts used to keep a stored summary up to date without re-reading the whole transcript
+update_summary_prompt = PromptTemplate(
+    input_variables=["summary", "conversation"],
+    template="Here is a brief summary of a conversation so far:\n\n{summary}\n\nUpdate it with the following new part of the conversation, keeping it brief and highlighting the main topics discussed and any key insights or recommendations:\n\n{conversation}\n\nUpdated summary:"
+)
+combine_summaries_prompt = PromptTemplate(
+    input_variables=["summaries"],
+    template="The following are summaries of consecutive parts of one conversation. Combine them into a single brief summary, highlighting the main topics discussed and any key insights or recommendations:\n\n{summaries}\n\nSummary:"
+)
+
+# Summary chains are stateless, so they are composed once and shared by every call
+summary_chain = summary_prompt | llm | StrOutputParser()
+update_summary_chain = update_summary_prompt | llm | StrOutputParser()
+combine_summaries_chain = combine_summaries_prompt | llm | StrOutputParser()
+
 # Function to generate a summary of the conversation
 def generate_summary(conversation_history):
-    summary_prompt = PromptTemplate(
-        input_variables=["conversation"],
-        template="Please provide a brief summary of the following conversation, highlighting the main topics discussed and any key insights or recommendations:\n\n{conversation}\n\nSummary:"
-    )
-    summary_chain = LLMChain(llm=llm, prompt=summary_prompt)
-    return summary_chain.predict(conversation=conversation_history)
+    return summary_chain.invoke({"conversation": conversation_history})
+
+# Fold new turns into an existing summary (used by the batch job)
+def update_summary(summary, conversation_history):
+    if not summary:
+        return generate_summary(conversation_history)
+    return update_summary_chain.invoke({"summary": summary, "conversation": conversation_history})
+
+# Async variant for the FastAPI handlers, so the event loop is not blocked on the LLM
+async def agenerate_summary(conversation_history):
+    return await summary_chain.ainvoke({"conversation": conversation_history})
+
+async def aupdate_summary(summary, conversation_history):
+    if not summary:
+        return await agenerate_summary(conversation_history)
+    return await update_summary_chain.ainvoke({"summary": summary, "conversation": conversation_history})
+
+async def acombine_summaries(summaries):
+    return await combine_summaries_chain.ainvoke({"summaries": "\n\n".join(summaries)})
+
+reply_chain = prompt | llm
+
+# Stream the chatbot reply chunk by chunk, then record the turn in memory
+async def astream_reply(human_input):
+    variables = memory.load_memory_variables({})
+    parts = []
+    async for chunk in reply_chain.astream({**variables, "human_input": human_input}):
+        text = chunk.content if isinstance(chunk.content, str) else "".join(
+            block.get("text", "") for block in chunk.content if isinstance(block, dict)
+        )
+        if text:
+            parts.append(text)
+            yield text
+    # Saving may summarize older turns with a blocking LLM call; asave_context runs it off the event loop
+    await memory.asave_context({"human_input": human_input}, {"output": "".join(parts)})
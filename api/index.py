@@ -1,14 +1,47 @@
 import sys
 import os
+import threading
+import time
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'python_api')))
 
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify
 from flask_cors import CORS
+from metrics import CONTENT_TYPE, render as render_metrics
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# Paths served by this module alone. Everything else goes to the chat routes,
+# which pull in langchain and are only imported on first use.
+LIGHT_PATHS = {'/api/test', '/api/hello', '/api/warmup', '/api/metrics'}
+
+chat_app = None
+chat_app_lock = threading.Lock()
+
+def get_chat_app():
+    global chat_app
+    if chat_app is None:
+        with chat_app_lock:
+            if chat_app is None:
+                from python_api.app import register_routes
+                routes = Flask(__name__)
+                CORS(routes, resources={r"/*": {"origins": "*"}})
+                register_routes(routes)
+                chat_app = routes
+    return chat_app
+
+class LazyChatRoutes:
+    def __init__(self, light_app):
+        self.light_app = light_app
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '') in LIGHT_PATHS:
+            return self.light_app(environ, start_response)
+        return get_chat_app().wsgi_app(environ, start_response)
+
+app.wsgi_app = LazyChatRoutes(app.wsgi_app)
+
 @app.route('/api/test', methods=['GET'])
 def test():
     return jsonify({"message": "API is working!"})
@@ -17,10 +50,25 @@ def test():
 def hello():
     return jsonify({"message": "Hello from Flask!"})
 
-from python_api.app import register_routes
-register_routes(app)
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    # Prometheus scrape target; served without loading the chat routes
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+@app.route('/api/warmup', methods=['GET', 'POST'])
+def warmup():
+    # Hit this after a deploy (or from a cron) so the first real chat doesn't pay for the imports
+    started = time.perf_counter()
+    get_chat_app()
+    from python_api.app import warm_up
+    result = warm_up()
+    return jsonify({**result, 'import_seconds': round(max(0.0, time.perf_counter() - started - result['seconds']), 3)})
+
+if os.environ.get('WARM_ON_START', 'false').lower() in ('1', 'true', 'yes'):
+    # Long-running servers can take the import cost in the background right away
+    threading.Thread(target=get_chat_app, daemon=True).start()
 
 print("Flask app initialized", file=sys.stderr)
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
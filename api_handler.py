@@ -1,20 +1,83 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from ai_setup import llm_chain, generate_summary
+from starlette.routing import Match
+from ai_setup import llm_chain, astream_reply
+from python_api.metrics import (CONTENT_TYPE, REQUEST_ID_HEADER, current_request_id, finish_request,
+                                observe_stage, render, start_request, timed)
 from supabase import create_client, Client
-from typing import List
+from write_behind import WriteBehindQueue
+from summaries import IncrementalSummaries
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from functools import partial
+from typing import List, Optional, Tuple
+import asyncio
+import base64
+import json
 import os
-
-app = FastAPI()
+import time
 
 # Initialize Supabase client
 supabase_url = os.environ.get("SUPABASE_URL")
 supabase_key = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(supabase_url, supabase_key)
 
+# The Supabase client is synchronous; run its calls on a bounded pool so they
+# never block the event loop and can't pile up unbounded threads.
+db_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("SUPABASE_MAX_WORKERS", 8)),
+    thread_name_prefix="supabase"
+)
+
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    with timed("supabase_io"):
+        return await loop.run_in_executor(db_executor, partial(func, *args, **kwargs))
+
+async def insert_conversations(rows: List[dict]):
+    await run_db(supabase.table("conversations").insert(rows).execute)
+
+# Conversation turns are written behind the response, in batches
+persistence = WriteBehindQueue(
+    insert_conversations,
+    batch_size=int(os.environ.get("PERSIST_BATCH_SIZE", 50)),
+    flush_interval=float(os.environ.get("PERSIST_FLUSH_INTERVAL", 0.5)),
+    max_queue_size=int(os.environ.get("PERSIST_MAX_QUEUE_SIZE", 10000))
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    persistence.start()
+    yield
+    # Don't lose buffered turns on shutdown
+    await persistence.close()
+
+app = FastAPI(lifespan=lifespan)
+
+def route_path(request: Request) -> str:
+    # The route pattern rather than the path, so session ids don't become label values
+    for route in app.router.routes:
+        if route.matches(request.scope)[0] == Match.FULL:
+            return route.path
+    return "other"
+
+@app.middleware("http")
+async def track_request(request: Request, call_next):
+    started = time.perf_counter()
+    endpoint = route_path(request)
+    # Set before the handler runs so its LLM calls are counted against this endpoint
+    start_request(endpoint, request.headers.get(REQUEST_ID_HEADER))
+    response = await call_next(request)
+    response.headers[REQUEST_ID_HEADER] = current_request_id()
+    finish_request(endpoint, request.method, response.status_code, time.perf_counter() - started)
+    return response
+
 class ChatInput(BaseModel):
     message: str
     session_id: str
+    stream: bool = False
 
 class ChatResponse(BaseModel):
     response: str
@@ -23,18 +86,127 @@ class ConversationSummary(BaseModel):
     session_id: str
     summary: str
 
+def save_turn(session_id: str, message: str, response: str):
+    persistence.enqueue({
+        "session_id": session_id,
+        "user_message": message,
+        "ai_response": response
+    })
+
+# Conversation rows are paged by (created_at, id); see sql/conversations_indexes.sql
+CONVERSATION_FIELDS = ("id", "session_id", "user_message", "ai_response", "created_at")
+PAGE_KEY = ("created_at", "id")
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(row: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps([row["created_at"], row["id"]]).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    # Both values end up inside a PostgREST filter: only accept a timestamp and an integer id
+    created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(created_at, str) or type(row_id) is not int:
+        raise ValueError("Invalid cursor")
+    datetime.fromisoformat(created_at)
+    return created_at, row_id
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(CONVERSATION_FIELDS)
+    columns = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [column for column in columns if column not in CONVERSATION_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return columns
+
+async def fetch_page(session_id: str, columns: List[str], after: Optional[Tuple[str, int]], limit: int) -> List[dict]:
+    # The page key is always selected so the next cursor can be built, even if not requested
+    select = list(dict.fromkeys(columns + list(PAGE_KEY)))
+    query = supabase.table("conversations").select(*select).eq("session_id", session_id)
+    if after:
+        created_at, row_id = after
+        query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{row_id})')
+    query = query.order("created_at").order("id").limit(limit)
+    result = await run_db(query.execute)
+    return result.data
+
+def project(rows: List[dict], columns: List[str]) -> List[dict]:
+    return [{column: row.get(column) for column in columns} for row in rows]
+
+async def iter_conversation_pages(session_id: str, columns: List[str], after: Optional[Tuple[str, int]], page_size: int):
+    # Read-your-writes: queued turns come after every stored row, so only the last page shows them
+    pending = persistence.pending(session_id)
+    while True:
+        rows = await fetch_page(session_id, columns, after, page_size)
+        if len(rows) < page_size:
+            yield project(persistence.merge(pending, rows), columns)
+            return
+        yield project(rows, columns)
+        after = (rows[-1]["created_at"], rows[-1]["id"])
+
+async def stream_conversations(session_id: str, columns: List[str], after: Optional[Tuple[str, int]], page_size: int):
+    # One row per line, read page by page so memory stays bounded by the page size
+    async for page in iter_conversation_pages(session_id, columns, after, page_size):
+        for row in page:
+            yield json.dumps(row, default=str) + "\n"
+
+async def fetch_rows_after(session_id: str, after_id: int) -> List[dict]:
+    query = (supabase.table("conversations").select("id", "user_message", "ai_response")
+             .eq("session_id", session_id).gt("id", after_id).order("id"))
+    result = await run_db(query.execute)
+    return result.data
+
+async def load_summary(session_id: str):
+    query = supabase.table("conversation_summaries").select("summary", "last_row_id").eq("session_id", session_id)
+    result = await run_db(query.execute)
+    if not result.data:
+        return None
+    return result.data[0]["summary"], result.data[0]["last_row_id"]
+
+async def save_summary(session_id: str, summary: str, last_row_id: int):
+    await run_db(supabase.table("conversation_summaries").upsert({
+        "session_id": session_id,
+        "summary": summary,
+        "last_row_id": last_row_id,
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    }).execute)
+
+# Summaries are stored with the id of the last row they cover and only fold in newer turns
+summaries = IncrementalSummaries(
+    fetch_rows_after,
+    load_summary,
+    save_summary,
+    chunk_chars=int(os.environ.get("SUMMARY_CHUNK_CHARS", 12000))
+)
+
+async def stream_chat(input: ChatInput):
+    # NDJSON frames: one per token chunk, then a final frame with the ChatResponse fields
+    try:
+        parts = []
+        started = time.perf_counter()
+        async for text in astream_reply(input.message):
+            if not parts:
+                observe_stage("llm_first_token", time.perf_counter() - started)
+            parts.append(text)
+            yield json.dumps({"type": "token", "content": text}) + "\n"
+        observe_stage("llm_call", time.perf_counter() - started)
+        response = "".join(parts)
+        save_turn(input.session_id, input.message, response)
+        yield json.dumps({"type": "final", **ChatResponse(response=response).model_dump()}) + "\n"
+    except Exception as e:
+        yield json.dumps({"type": "error", "detail": str(e)}) + "\n"
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(input: ChatInput):
+    if input.stream:
+        return StreamingResponse(stream_chat(input), media_type="application/x-ndjson")
     try:
         # Get the AI response
-        response = llm_chain.predict(human_input=input.message)
+        with timed("llm_call"):
+            response = await llm_chain.apredict(human_input=input.message)
         
         # Save the conversation to Supabase
-        supabase.table("conversations").insert({
-            "session_id": input.session_id,
-            "user_message": input.message,
-            "ai_response": response
-        }).execute()
+        save_turn(input.session_id, input.message, response)
         
         return ChatResponse(response=response)
     except Exception as e:
@@ -43,23 +215,56 @@ async def chat(input: ChatInput):
 @app.get("/summary/{session_id}", response_model=ConversationSummary)
 async def get_summary(session_id: str):
     try:
-        # Fetch the conversation history from Supabase
-        result = supabase.table("conversations").select("user_message", "ai_response").eq("session_id", session_id).execute()
-        
-        # Combine the messages into a single string
-        conversation_history = "\n".join([f"User: {msg['user_message']}\nAI: {msg['ai_response']}" for msg in result.data])
-        
-        # Generate a summary
-        summary = generate_summary(conversation_history)
+        # Turns still in the write-behind queue are folded in without being stored
+        with timed("summary"):
+            summary = await summaries.get(session_id, persistence.pending(session_id))
         
         return ConversationSummary(session_id=session_id, summary=summary)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/conversations/{session_id}", response_model=List[dict])
-async def get_conversations(session_id: str):
+async def get_conversations(
+    session_id: str,
+    response: Response,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
+    columns = parse_fields(fields)
+    try:
+        cursor = decode_cursor(after) if after else None
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_conversations(session_id, columns, cursor, limit or DEFAULT_PAGE_SIZE),
+            media_type="application/x-ndjson"
+        )
+
     try:
-        result = supabase.table("conversations").select("*").eq("session_id", session_id).execute()
-        return result.data
+        if limit is None and cursor is None:
+            # Unpaginated: the whole session, as before
+            rows = []
+            async for page in iter_conversation_pages(session_id, columns, None, MAX_PAGE_SIZE):
+                rows.extend(page)
+            return rows
+
+        # A cursor without a limit pages at the default size
+        limit = limit or DEFAULT_PAGE_SIZE
+        pending = persistence.pending(session_id)
+        rows = await fetch_page(session_id, columns, cursor, limit)
+        if len(rows) < limit:
+            rows = persistence.merge(pending, rows)
+        elif rows:
+            response.headers["X-Next-Cursor"] = encode_cursor(rows[-1])
+        return project(rows, columns)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus scrape target
+    return Response(render(), media_type=CONTENT_TYPE)
@@ -1,161 +1,105 @@
 import os
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
+
+# Load environment variables before the modules below read their settings
+load_dotenv()
+
+from flask import Flask, Response, g, make_response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from langchain_anthropic import ChatAnthropic
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import LLMChain
 import traceback
 import json
 import uuid
 import time
-from typing import List, Dict
+from typing import List, Dict, Optional
 from werkzeug.exceptions import HTTPException
+import math
 import re
-
-# Load environment variables
-load_dotenv()
+import threading
+from session_store import create_session_store, new_session
+from suggestion_jobs import SuggestionJobs
+from prompts import SYSTEM_PREFIX, prompt, prompt_cache_metrics, usage_report
+from llm_client import create_llm, warm_connections
+from turn_executor import TurnExecutor, history_messages
+from greetings import GREETING_INSTRUCTION, GreetingCache, greeting_key
+from history import compact_history, compaction_metrics, estimate_tokens, summarizer
+from metrics import (REQUEST_ID_HEADER, breaker_transitions, current_request_id, finish_request, idempotent_replays,
+                     observe_stage, record_tokens, requests_shed, start_request, timed)
+from resilience import AdmissionControl, CircuitBreaker, CircuitOpen, Lease, Rejected, SessionLocks, backoff_delay
+from idempotency import IdempotentResponses, request_key
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# Ask for reply, suggestions and flags in one call; requests can override with "structured"
+STRUCTURED_TURNS = os.environ.get('STRUCTURED_TURNS', 'false').lower() in ('1', 'true', 'yes')
+# Return the reply at once and serve suggestions from /api/suggestions; requests can override with "deferSuggestions"
+DEFER_SUGGESTIONS = os.environ.get('DEFER_SUGGESTIONS', 'false').lower() in ('1', 'true', 'yes')
+SUGGESTIONS_TIMEOUT = float(os.environ.get('SUGGESTIONS_TIMEOUT', 15))  # seconds
+SUGGESTIONS_MAX_WAIT = 10  # seconds a client may long-poll for suggestions
+GREETINGS_FILE = os.environ.get('GREETINGS_FILE')  # written by `python greetings.py`
+
+# Admission control: chat requests running at once, and how many may wait (and for how long) behind them
+CHAT_MAX_CONCURRENCY = int(os.environ.get('CHAT_MAX_CONCURRENCY', 16))
+CHAT_MAX_QUEUE = int(os.environ.get('CHAT_MAX_QUEUE', 64))
+CHAT_QUEUE_TIMEOUT = float(os.environ.get('CHAT_QUEUE_TIMEOUT', 10))  # seconds
+SESSION_LOCK_TIMEOUT = float(os.environ.get('SESSION_LOCK_TIMEOUT', 30))  # seconds to wait for the previous message
+# Duplicate submissions of a message are answered from the first one's reply for this long
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 30))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', 1000))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 60))  # a duplicate waits this long for the first reply
+# The LLM circuit opens after this many consecutive failures and tries again after the reset delay
+LLM_BREAKER_FAILURES = int(os.environ.get('LLM_BREAKER_FAILURES', 5))
+LLM_BREAKER_RESET_SECONDS = float(os.environ.get('LLM_BREAKER_RESET_SECONDS', 30))
+
 # Initialize ChatAnthropic model
 MAX_RETRIES = 3
-RETRY_DELAY = 2  # seconds
+RETRY_BASE_DELAY = 0.5  # seconds, doubled on each attempt, with jitter
+RETRY_MAX_DELAY = 8  # seconds
 
 def initialize_llm():
     for attempt in range(MAX_RETRIES):
         try:
-            return ChatAnthropic(model="claude-3-sonnet-20240229")
+            # One pooled client for every conversation; the SDK is only imported once a chat starts
+            return create_llm(on_usage=record_tokens)
         except Exception as e:
             if attempt < MAX_RETRIES - 1:
-                print(f"Attempt {attempt + 1} failed. Retrying in {RETRY_DELAY} seconds...")
-                time.sleep(RETRY_DELAY)
+                delay = backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+                print(f"Attempt {attempt + 1} failed. Retrying in {delay:.1f} seconds...")
+                with timed('retry_sleep'):
+                    time.sleep(delay)
             else:
                 print(f"Error initializing ChatAnthropic after {MAX_RETRIES} attempts: {str(e)}")
                 raise
 
-try:
-    llm = initialize_llm()
-except Exception as e:
-    print(f"Failed to initialize ChatAnthropic: {str(e)}")
-    llm = None
-
-# Define conversation template
-template = """
-Your name is **Coopleo** (in bold). 
-You are a couple relationship advisor created to assist users with all their relationship health, well-being, and behavioral concerns. 
-When interacting with users, guide them through a structured consultation process.
-The goal is to help the user to understand their relationship and to help them to improve it.
-Conclude this consultation process professionally after 8-10 exchanges by providing **final recommendations**.
-You only speak French and use a professional tone and language.
-
-Strict Single Response Protocol: 
-The AI agent is required to adhere strictly to a protocol where it provides a single, concise response to each user input. This response should be focused, relevant, and succinct. 
-Keep responses between 2-3 sentences maximum, without using ellipsis or any form of truncation.
-Prioritize asking a question to understand the user's needs better.
-Do not provide detailed advice in the main response, except to end the conversation with **final recommendations**.
-
-# Context
-
-The user has provided the following initial context:
-* Current state of the relationship: {state}
-* Current user mood: {mood}
-* Current situation awareness: {location}
-* Relationship topic to focus on: {topic}
-
-Keep this context in mind throughout the conversation, but allow the user to freely discuss their concerns. Pay special attention to the chosen topic {topic} that the user has chosen to focus on.
-
-# Response Format
-
-Structure your single, unified response as follows:
-1. For the first interaction:
-   a. Greet the user naturally, say you're **Coopleo**.
-   b. Ask for the user's name only once and never again.
-   c. Use the user's name in your response. If none is provided, don't use it.
-
-2. For subsequent interactions:
-   a. Address the user by name if known. 
-   b. A 1 sentence brief acknowledgment or validation of the user's previous statement.
-   c. A very short insight related to the user's concern, focusing on the chosen topic when relevant.
-   d. A single, focused follow-up question to encourage further discussion about the chosen topic.
-
-Combine these elements into one cohesive response. Do not separate them into multiple messages or paragraphs.
-
-# End of Conversation
-
-After approximately 8-10 exchanges, or when the conversation naturally concludes, provide your final recommendations as follows:
-
-1. Briefly summarize the key points discussed in a short paragraph, focusing on the main topic: {topic}.
-
-2. Highlight any progress or insights gained during the conversation.
-
-3. Offer 3-5 actionable recommendations to improve the user's relationship, based on the conversation history. Present these as bullet points for clarity:
-
-   • [First recommendation]
-   • [Second recommendation]
-   • [Third recommendation]
-   • [Fourth recommendation (if applicable)]
-   • [Fifth recommendation (if applicable)]
-
-   Ensure these recommendations are specific, tailored to the user's situation, and actionable.
-
-4. Ask the user if they would like to receive these recommendations via email.
-
-Use the exact phrase "final recommendations" when providing the recommendations. After the user says yes, or no, kindly thank them for their time and end the conversation. 
-
-# Rules
-
-1. Make your answers as clear and concise as possible, limited to 1-2 sentences maximum.
-2. Always end your response by asking only one question.
-3. In each response, use Markdown bold syntax (text) to emphasize exactly one key phrase or sentence. Choose the most important or impactful idea to highlight.
-4. Never prescribe medication or provide medical advice.
-5. In all interactions and recommendations, refrain from suggesting or recommending couples counseling, therapy, or any form of professional psychological intervention. Instead, focus on providing actionable advice, communication strategies, and self-help techniques that the couple can implement independently.
-6. Only use biologicial his or her pronouns.
-7. Maintain strict confidentiality and remind users of privacy considerations when discussing sensitive topics.
-8. Encourage open communication between partners while respecting individual privacy.
-9. Avoid taking sides in disputes; instead, focus on facilitating understanding and compromise.
-10. Be sensitive to cultural differences in relationship norms and expectations.
-11. Promote healthy relationship practices and boundaries.
-12. Never invent or assume the user's name.
-13. Always steer the conversation back to the chosen topic {topic}.
-14. Do not say you are an AI agent or chatbot. Say you are a relationship advisor for couples.
-15. End the conversation with a very short summary of the history of the conversation and "final recommandations" tool focused on the topic {topic}.
-16. Trigger the "email-prompt" tool to show the UI component.
-
-# Language selection
-
-1. Whenever a user interacts with you, detect the language used in their query and respond in that same language.
-2. Utilize the text of the user's input to determine the language.
-3. If the language is ambiguous or mixed, default to the most prominently used language in the query.
-4. Ensure your responses are culturally and contextually appropriate for the language and region.
-
-Examples:
-
-1. If the user speaks French, respond in French.
-2. If the user speaks Spanish, respond in Spanish.
-3. If the query contains multiple languages, choose the one that is most used in the query for your response.
-
-# Continuous Improvement
-
-At the end of each session, ask the user if they would like these final recommendations sent to their email.
-After the user says yes, or no, kindly thank them for thei time and end the conversation.
-
-Current conversation:
-{history}
-H: {input}
-AI: """
-
-prompt = ChatPromptTemplate.from_messages([
-    ("system", template),
-    MessagesPlaceholder(variable_name="history"),
-    ("human", "{input}")
-])
-
-conversations: Dict[str, Dict] = {}
-
-def generate_suggestions(response: str, conversation_history: List[str]) -> List[str]:
+# Created on first use rather than at import, so cold starts that never chat don't pay for it
+llm = None
+llm_lock = threading.Lock()
+
+def get_llm():
+    global llm
+    if llm is None:
+        with llm_lock:
+            if llm is None:
+                try:
+                    llm = initialize_llm()
+                except Exception as e:
+                    print(f"Failed to initialize ChatAnthropic: {str(e)}")
+    return llm
+
+conversations = create_session_store()
+# Bad model output (parsing/validation errors) is not a provider failure
+llm_breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS, ignore=(ValueError,),
+                             on_state_change=lambda state: breaker_transitions.inc(1, state))
+turns = TurnExecutor(get_llm, llm_breaker)
+admission = AdmissionControl(CHAT_MAX_CONCURRENCY, CHAT_MAX_QUEUE, CHAT_QUEUE_TIMEOUT)
+session_locks = SessionLocks(SESSION_LOCK_TIMEOUT)
+idempotent_responses = IdempotentResponses(IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_ENTRIES)
+
+SYSTEM_PREFIX_TOKENS = estimate_tokens(SYSTEM_PREFIX)
+
+def generate_suggestions(response: str, conversation_history: List[str], cancelled: Optional[threading.Event] = None,
+                         attempts: int = MAX_RETRIES) -> List[str]:
     prompt = f"""
     Based on the following conversation history and the AI's last response, generate 3 short, natural, and relevant examples of what the user might say next.
    
@@ -176,21 +120,224 @@ def generate_suggestions(response: str, conversation_history: List[str]) -> List
 
     """
 
-    for attempt in range(MAX_RETRIES):
+    for attempt in range(attempts):
+        if cancelled is not None and cancelled.is_set():
+            return []
         try:
-            suggestions_response = llm.generate([prompt])
-            suggestions = suggestions_response.generations[0][0].text.strip().split('\n')
+            with timed('suggestions'), llm_breaker.guard():
+                suggestions_response = get_llm().invoke(prompt)
+            suggestions = chunk_text(suggestions_response).strip().split('\n')
             suggestions = [s.strip() for s in suggestions if s.strip()]
             suggestions = [s for s in suggestions if 2 <= len(s.split()) <= 10 and not s.startswith('(')]
             return suggestions[:3]
+        except CircuitOpen:
+            return []
         except Exception as e:
-            if attempt < MAX_RETRIES - 1:
-                print(f"Attempt {attempt + 1} failed. Retrying in {RETRY_DELAY} seconds...")
-                time.sleep(RETRY_DELAY)
+            if attempt < attempts - 1:
+                delay = backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+                print(f"Attempt {attempt + 1} failed. Retrying in {delay:.1f} seconds...")
+                with timed('retry_sleep'):
+                    if cancelled is not None:
+                        cancelled.wait(delay)
+                    else:
+                        time.sleep(delay)
             else:
-                print(f"Error generating suggestions after {MAX_RETRIES} attempts: {str(e)}")
+                print(f"Error generating suggestions after {attempts} attempts: {str(e)}")
                 return []
 
+FALLBACK_SUGGESTIONS = ["J'aimerais mettre cela en pratique", "Cela me dérangerait personnellement", "C'est un sacré défi pour notre couple"]
+
+suggestion_jobs = SuggestionJobs(FALLBACK_SUGGESTIONS, timeout=SUGGESTIONS_TIMEOUT)
+
+greeting_cache = GreetingCache(
+    variants_per_key=int(os.environ.get('GREETING_CACHE_VARIANTS', 3)),
+    max_keys=int(os.environ.get('GREETING_CACHE_MAX_KEYS', 1000)),
+    ttl_seconds=float(os.environ.get('GREETING_CACHE_TTL_SECONDS', 24 * 60 * 60))
+)
+if GREETINGS_FILE:
+    try:
+        print(f"Loaded {greeting_cache.load(GREETINGS_FILE)} cached greeting contexts")
+    except Exception as e:
+        print(f"Failed to load greetings from {GREETINGS_FILE}: {str(e)}")
+
+def extract_recommendations(response: str) -> str:
+    with timed('recommendation_extraction'):
+        recommendations = re.findall(r'•\s*(.*?)(?:\n|$)', response)
+        return '\n'.join(f'• {rec}' for rec in recommendations)
+
+def record_usage(message) -> Dict:
+    usage = usage_report(message)
+    prompt_cache_metrics.record(usage)
+    print(f"Input tokens: {usage['cached_input_tokens']} cached, {usage['cache_write_input_tokens']} written to cache, {usage['uncached_input_tokens']} uncached")
+    return usage
+
+def invoke_turn(history: List, context: Dict, input_message: str):
+    message = turns.invoke(history, context, input_message)
+    return chunk_text(message), record_usage(message)
+
+def save_turn(conversation_id: str, conversation: Dict, input_message: str, response: str) -> Dict:
+    # Each turn adds exactly one human and one AI message
+    new_messages = [['human', input_message], ['ai', response]]
+    conversation['messages'].extend(new_messages)
+    with timed('session_save'):
+        return conversations.commit_turn(conversation_id, conversation, new_messages)
+
+def finish_turn(conversation_id: str, conversation: Dict, response: str, defer_suggestions: bool = False,
+                usage: Optional[Dict] = None) -> Dict:
+    contains_recommendations = any(phrase in response.lower() for phrase in ["final recommendations", "recommandations finales"])
+    asks_for_email = "email" in response.lower() and "?" in response
+
+    print(f"Response: {response}")
+    print(f"Contains recommendations: {contains_recommendations}")
+    print(f"Asks for email: {asks_for_email}")
+
+    suggestions = []
+    suggestions_pending = False
+    if contains_recommendations:
+        suggestions = []  # Empty suggestions for final recommendations
+    elif conversation['message_count'] > 1 and defer_suggestions:
+        suggestion_jobs.submit(conversation_id, generate_suggestions, response, [message[1] for message in conversation['messages']])
+        suggestions_pending = True
+    elif conversation['message_count'] > 1:
+        # Inline, a failed call falls back at once rather than holding the request in retry sleeps
+        suggestions = generate_suggestions(response, [message[1] for message in conversation['messages']], attempts=1)
+        if not suggestions:
+            suggestions = FALLBACK_SUGGESTIONS
+
+    final_recommendations = extract_recommendations(response) if contains_recommendations else ""
+
+    return {
+        'response': response,
+        'suggestions': suggestions,
+        'conversation_id': conversation_id,
+        'contains_recommendations': contains_recommendations,
+        'asks_for_email': asks_for_email,
+        'final_recommendations': final_recommendations,
+        'suggestions_pending': suggestions_pending,
+        'usage': usage or {}
+    }
+
+def structured_turn(conversation_id: str, conversation: Dict, history: List, context: Dict, input_message: str):
+    # Returns None when the structured call fails, so the caller can fall back to two calls
+    try:
+        result, raw = turns.structured(history, context, input_message)
+    except Exception as e:
+        print(f"Structured turn failed, falling back to separate suggestions call: {str(e)}")
+        return None
+
+    conversation = save_turn(conversation_id, conversation, input_message, result.reply)
+    usage = record_usage(raw)
+
+    print(f"Response: {result.reply}")
+    print(f"Contains recommendations: {result.contains_recommendations}")
+    print(f"Asks for email: {result.asks_for_email}")
+
+    suggestions = []
+    if not result.contains_recommendations and conversation['message_count'] > 1:
+        suggestions = result.suggestions or FALLBACK_SUGGESTIONS
+
+    final_recommendations = ""
+    if result.contains_recommendations:
+        final_recommendations = '\n'.join(f'• {rec}' for rec in result.final_recommendations) or extract_recommendations(result.reply)
+
+    return {
+        'response': result.reply,
+        'suggestions': suggestions,
+        'conversation_id': conversation_id,
+        'contains_recommendations': result.contains_recommendations,
+        'asks_for_email': result.asks_for_email,
+        'final_recommendations': final_recommendations,
+        'suggestions_pending': False,
+        'usage': usage
+    }
+
+def chunk_text(chunk) -> str:
+    if isinstance(chunk.content, str):
+        return chunk.content
+    return ''.join(block.get('text', '') for block in chunk.content if isinstance(block, dict))
+
+def cached_turn(conversation_id: str, conversation: Dict, input_message: str, response: str) -> Dict:
+    # Record a precomputed reply as if the model had just produced it
+    conversation = save_turn(conversation_id, conversation, input_message, response)
+    return finish_turn(conversation_id, conversation, response)
+
+def stream_cached_turn(result: Dict):
+    yield json.dumps({'type': 'token', 'content': result['response']}) + '\n'
+    yield json.dumps({'type': 'final', **result}) + '\n'
+
+def json_body() -> Dict:
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+def idempotency_keys(data: Dict):
+    # Returns (key, earlier_key); no key means the request is handled as is. Client keys have no earlier_key
+    conversation_id = data.get('conversation_id')
+    client_key = request.headers.get(IDEMPOTENCY_HEADER) or data.get('idempotencyKey')
+    if client_key:
+        return request_key(conversation_id, client_key=str(client_key)[:200]), None
+    if not conversation_id or not data.get('message'):
+        # New conversations are only deduplicated with a client key: identical contexts from different users are common
+        return None, None
+    with timed('session_lookup'):
+        conversation = conversations.get(conversation_id)
+    if conversation is None:
+        return None, None
+    # A duplicate that arrives after the first request was committed, but before it finished, sees the turn count one higher
+    turn = conversation['message_count']
+    return request_key(conversation_id, data['message'], turn), request_key(conversation_id, data['message'], turn - 1)
+
+def replay(result: Dict, stream: bool):
+    response = Response(stream_cached_turn(result), mimetype='application/x-ndjson') if stream else jsonify(result)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def remember_final_frame(stream, key: str, remember: bool):
+    result = None
+    try:
+        for line in stream:
+            if line.startswith('{"type": "final"'):
+                result = {k: v for k, v in json.loads(line).items() if k != 'type'}
+            yield line
+    finally:
+        idempotent_responses.finish(key, result, remember)
+
+def stream_turn(conversation_id: str, conversation: Dict, history: List, context: Dict, input_message: str,
+                defer_suggestions: bool = False, greeting: Optional[tuple] = None):
+    # One JSON object per line: token frames while the model writes, then a
+    # final frame with the same fields as the non-streaming response.
+    try:
+        parts = []
+        message = None
+        started = time.perf_counter()
+        for chunk in turns.stream(history, context, input_message):
+            if message is None:
+                observe_stage('llm_first_token', time.perf_counter() - started)
+            # Chunks add up to the full message, including its usage metadata
+            message = chunk if message is None else message + chunk
+            text = chunk_text(chunk)
+            if text:
+                parts.append(text)
+                yield json.dumps({'type': 'token', 'content': text}) + '\n'
+        observe_stage('llm_call', time.perf_counter() - started)
+        response = ''.join(parts)
+        conversation = save_turn(conversation_id, conversation, input_message, response)
+        usage = record_usage(message)
+        if greeting:
+            greeting_cache.add(greeting, response)
+        yield json.dumps({'type': 'final', **finish_turn(conversation_id, conversation, response, defer_suggestions, usage)}) + '\n'
+    except Exception as e:
+        print(f"[{current_request_id()}] Error in streamed conversation processing: {str(e)}")
+        print(traceback.format_exc())
+        yield json.dumps({'type': 'error', 'error': f'Error in AI processing: {str(e)}'}) + '\n'
+
+def warm_up() -> Dict:
+    """Do the one-off startup work ahead of the first chat: create the LLM client, open a pooled connection and render the prompt."""
+    started = time.perf_counter()
+    llm = get_llm()
+    connected = llm is not None and warm_connections(llm)
+    prompt.invoke(turns.variables([], {}, ''))
+    return {'llm_ready': llm is not None, 'connection_ready': connected, 'seconds': round(time.perf_counter() - started, 3)}
+
 @app.errorhandler(Exception)
 def handle_exception(e):
     # Pass through HTTP errors
@@ -199,10 +346,87 @@ def handle_exception(e):
     # Now you're handling non-HTTP exceptions only
     return jsonify(error=str(e)), 500
 
+def rejection(e: Rejected):
+    requests_shed.inc(1, e.reason)
+    return jsonify({'error': str(e)}), e.status, {'Retry-After': str(max(1, math.ceil(e.retry_after)))}
+
+def request_endpoint() -> str:
+    # The route pattern rather than the path, so conversation ids don't become label values
+    return request.url_rule.rule if request.url_rule else 'other'
+
 def register_routes(app):
+    @app.before_request
+    def begin_request():
+        g.request_started = time.perf_counter()
+        start_request(request_endpoint(), request.headers.get(REQUEST_ID_HEADER))
+
+    @app.after_request
+    def end_request(response):
+        # For streamed replies this is the time to the first byte, the body is still being generated
+        response.headers[REQUEST_ID_HEADER] = current_request_id()
+        finish_request(request_endpoint(), request.method, response.status_code, time.perf_counter() - g.request_started)
+        return response
+
     @app.route('/api/chat', methods=['POST'])
     def chat():
-        if llm is None:
+        data = json_body()
+        stream = data.get('stream', False)
+        key, earlier_key = idempotency_keys(data)
+        # Only replies to client keys are kept: without one, the same message later is a new turn
+        remember = earlier_key is None
+        if key:
+            state, value = idempotent_responses.claim(key, earlier_key)
+            if state == 'wait':
+                # An identical request is being answered: share its reply instead of calling the LLM again
+                result = value.wait(IDEMPOTENCY_WAIT_SECONDS)
+                if result is not None:
+                    idempotent_replays.inc(1, 'coalesced')
+                    return replay(result, stream)
+                key = None  # It failed: handle this one on its own
+            elif state == 'cached':
+                idempotent_replays.inc(1, 'cached')
+                return replay(value, stream)
+
+        try:
+            response = admitted_chat_turn()
+        except BaseException:
+            if key:
+                idempotent_responses.finish(key, None)
+            raise
+        if key:
+            if response.is_streamed:
+                response.response = remember_final_frame(response.response, key, remember)
+            else:
+                idempotent_responses.finish(key, response.get_json(silent=True) if response.status_code == 200 else None, remember)
+        return response
+
+    def admitted_chat_turn():
+        # The conversation's own lock first, then admission: messages waiting behind another one
+        # for the same conversation must not hold one of the global slots while they wait
+        lease = Lease()
+        try:
+            conversation_id = json_body().get('conversation_id')
+            if conversation_id:
+                lease.add(session_locks.acquire(conversation_id))
+            lease.add(admission.acquire())
+        except Rejected as e:
+            lease.release()
+            return make_response(rejection(e))
+
+        try:
+            response = make_response(chat_turn())
+        except BaseException:
+            lease.release()
+            raise
+        if response.is_streamed:
+            # Held until the stream is fully sent or the client goes away
+            response.response = lease.wrap(response.response)
+        else:
+            lease.release()
+        return response
+
+    def chat_turn():
+        if get_llm() is None:
             return jsonify({'error': 'ChatAnthropic is not initialized'}), 500
 
         try:
@@ -211,89 +435,87 @@ def register_routes(app):
             is_initial_context = data.get('isInitialContext', False)
             conversation_id = data.get('conversation_id')
             context = data.get('context')
+            stream = data.get('stream', False)
+            structured = data.get('structured', STRUCTURED_TURNS)
+            defer_suggestions = data.get('deferSuggestions', DEFER_SUGGESTIONS)
 
             if not message:
                 return jsonify({'error': 'Message is required'}), 400
 
-            if not conversation_id or conversation_id not in conversations:
+            # A new message makes any pending suggestions for the previous reply stale
+            suggestion_jobs.cancel(conversation_id)
+            with timed('session_lookup'):
+                conversation = conversations.get(conversation_id)
+            if conversation is None:
                 conversation_id = str(uuid.uuid4())
-                memory = ConversationBufferMemory(return_messages=True, input_key="input", memory_key="history")
-                conversations[conversation_id] = {
-                    'chain': LLMChain(
-                        llm=llm,
-                        prompt=prompt,
-                        verbose=True,
-                        memory=memory
-                    ) if llm is not None else None,
-                    'context': context or {},
-                    'message_count': 0
-                }
-
-            conversation = conversations[conversation_id]
-            conversation['message_count'] += 1
+                conversation = new_session(context)
 
-            if conversation['chain'] is None:
-                return jsonify({'error': 'LLM chain is not initialized'}), 500
+            conversation['message_count'] += 1
 
             try:
                 if is_initial_context:
                     context = json.loads(message) if isinstance(message, str) else message
                     conversation['context'] = context
-                    input_message = "Greet the user naturally, say you're **Coopleo** and ask for their name."
+                    input_message = GREETING_INSTRUCTION
                 else:
                     context = conversation['context']
                     input_message = f"The user's message: {message}\nRespond naturally without reintroducing yourself. Remember the context of the ongoing conversation."
 
                 # Always trigger final recommendations after 10 exchanges
                 if conversation['message_count'] >= 10:
-                    input_message += "\nProvide final recommendations now, focusing on the topic: {topic}. Remember to summarize key points discussed, highlight progress or insights, and offer 3-5 actionable recommendations. End by asking if they want to receive these recommendations via email."
-
-                response = conversation['chain'].predict(
-                    input=input_message,
-                    state=context.get('state', 'Unknown'),
-                    mood=context.get('mood', 'Unknown'),
-                    location=context.get('location', 'Unknown'),
-                    topic=context.get('topic', 'relationships in general')
-                )
-
-                contains_recommendations = any(phrase in response.lower() for phrase in ["final recommendations", "recommandations finales"])
-                asks_for_email = "email" in response.lower() and "?" in response
-
-                print(f"Response: {response}")
-                print(f"Contains recommendations: {contains_recommendations}")
-                print(f"Asks for email: {asks_for_email}")
-
-                suggestions = []
-                if contains_recommendations:
-                    suggestions = []  # Empty suggestions for final recommendations
-                elif conversation['message_count'] > 1:
-                    suggestions = generate_suggestions(response, [str(msg.content) for msg in conversation['chain'].memory.chat_memory.messages])
-                    if not suggestions:
-                        suggestions = ["J'aimerais mettre cela en pratique", "Cela me dérangerait personnellement", "C'est un sacré défi pour notre couple"]
-
-                def extract_recommendations(response: str) -> str:
-                    recommendations = re.findall(r'•\s*(.*?)(?:\n|$)', response)
-                    return '\n'.join(f'• {rec}' for rec in recommendations)
-
-                # In your chat route
-                final_recommendations = extract_recommendations(response) if contains_recommendations else ""
-
-                return jsonify({
-                    'response': response,
-                    'suggestions': suggestions,
-                    'conversation_id': conversation_id,
-                    'contains_recommendations': contains_recommendations,
-                    'asks_for_email': asks_for_email,
-                    'final_recommendations': final_recommendations  # Add this line
-                })
-
+                    input_message += "\nProvide final recommendations now, focusing on the topic: " + context.get('topic', 'relationships in general') + ". Remember to summarize key points discussed, highlight progress or insights, and offer 3-5 actionable recommendations. End by asking if they want to receive these recommendations via email."
+
+                try:
+                    with timed('history_compaction'):
+                        history_stats = compact_history(
+                            conversation, llm_breaker.wrap(summarizer(get_llm())), base_tokens=SYSTEM_PREFIX_TOKENS + estimate_tokens(input_message)
+                        )
+                    print(f"Prompt tokens: {history_stats['tokens_before']} before compaction, {history_stats['tokens_after']} after")
+                except Exception as e:
+                    # The history is left as it was; this turn goes ahead with it uncompacted
+                    print(f"[{current_request_id()}] History compaction failed, skipping it for this turn: {str(e)}")
+                history = history_messages(conversation)
+
+                greeting = None
+                if is_initial_context:
+                    header_language = request.accept_languages.best if request.accept_languages else None
+                    greeting = greeting_key(context, fallback_language=header_language)
+                    cached_greeting = greeting_cache.get(greeting)
+                    if cached_greeting is not None:
+                        result = cached_turn(conversation_id, conversation, input_message, cached_greeting)
+                        if stream:
+                            return Response(stream_cached_turn(result), mimetype='application/x-ndjson')
+                        return jsonify(result)
+
+                if stream:
+                    return Response(
+                        stream_with_context(stream_turn(conversation_id, conversation, history, context, input_message, defer_suggestions, greeting)),
+                        mimetype='application/x-ndjson'
+                    )
+
+                if structured:
+                    result = structured_turn(conversation_id, conversation, history, context, input_message)
+                    if result is not None:
+                        if greeting:
+                            greeting_cache.add(greeting, result['response'])
+                        return jsonify(result)
+
+                response, usage = invoke_turn(history, context, input_message)
+                conversation = save_turn(conversation_id, conversation, input_message, response)
+                if greeting:
+                    greeting_cache.add(greeting, response)
+
+                return jsonify(finish_turn(conversation_id, conversation, response, defer_suggestions, usage))
+
+            except CircuitOpen as e:
+                return rejection(e)
             except Exception as e:
-                print(f"Error in conversation processing: {str(e)}")
+                print(f"[{current_request_id()}] Error in conversation processing: {str(e)}")
                 print(traceback.format_exc())
                 return jsonify({'error': f'Error in AI processing: {str(e)}'}), 500
 
         except Exception as e:
-            print(f"Error in /chat: {str(e)}")
+            print(f"[{current_request_id()}] Error in /chat: {str(e)}")
             print(traceback.format_exc())
             return jsonify({'error': f'An error occurred processing your request: {str(e)}'}), 500
 
@@ -302,13 +524,34 @@ def register_routes(app):
         try:
             data = request.json
             conversation_id = data.get('conversation_id')
-            if conversation_id in conversations:
-                del conversations[conversation_id]
+            conversations.delete(conversation_id)
             return jsonify({"message": "Conversation reset successfully"})
         except Exception as e:
             print(f"Error in /reset: {str(e)}")
             return jsonify({"error": "An error occurred resetting the conversation", "details": str(e)}), 500
 
+    @app.route('/api/suggestions/<conversation_id>', methods=['GET'])
+    def get_suggestions(conversation_id):
+        wait = min(request.args.get('wait', 0, type=float), SUGGESTIONS_MAX_WAIT)
+        result = suggestion_jobs.result(conversation_id, wait=wait)
+        if result is None:
+            return jsonify({'error': 'No suggestions pending for this conversation'}), 404
+        ready, suggestions = result
+        return jsonify({'conversation_id': conversation_id, 'ready': ready, 'suggestions': suggestions})
+
+    @app.route('/api/sessions/stats', methods=['GET'])
+    def session_stats():
+        return jsonify({
+            **conversations.stats(),
+            'history': compaction_metrics.stats(),
+            'prompt_cache': prompt_cache_metrics.stats(),
+            'greetings': greeting_cache.stats(),
+            'admission': admission.stats(),
+            'session_locks': session_locks.stats(),
+            'llm_breaker': llm_breaker.stats(),
+            'idempotency': idempotent_responses.stats()
+        })
+
 # Make sure to export the app
 app = app
 
@@ -0,0 +1,136 @@
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from prompts import context_values, prompt, system_message
+
+# Greetings for the isInitialContext turn only depend on the session context
+# and the language, so they are cached per (context, language) key. Each key
+# holds a small pool of variants; a key is served from cache once its pool is
+# full, and until then every live greeting is added to it. A model that keeps
+# repeating itself may never fill a pool, so a key is also served once twice
+# the pool size in greetings have been offered for it (the same number of
+# attempts ``warm`` makes), and pools loaded from ``warm`` are served as is.
+
+GREETING_INSTRUCTION = "Greet the user naturally, say you're **Coopleo** and ask for their name."
+DEFAULT_LANGUAGE = 'fr'
+
+GreetingKey = Tuple[str, ...]
+
+
+def _normalize(value: str) -> str:
+    return re.sub(r'\s+', ' ', value).strip().lower()
+
+
+def greeting_key(context: Dict, fallback_language: Optional[str] = None) -> GreetingKey:
+    # The context's own language wins; ``fallback_language`` (e.g. from Accept-Language) only fills in when it has none
+    values = context_values(context)
+    language = _normalize(context.get('language') or fallback_language or DEFAULT_LANGUAGE).split('-')[0]
+    return tuple(_normalize(values[k]) for k in ('state', 'mood', 'location', 'topic')) + (language,)
+
+
+class GreetingCache:
+    def __init__(self, variants_per_key: int = 3, max_keys: int = 1000, ttl_seconds: float = 24 * 60 * 60):
+        self.variants_per_key = variants_per_key
+        self.max_keys = max_keys
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[GreetingKey, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: GreetingKey) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and self.ttl_seconds and time.time() - entry[1] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None or not self._ready(entry):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return random.choice(entry[0])
+
+    def _ready(self, entry: tuple) -> bool:
+        variants, _, offered = entry
+        return len(variants) >= self.variants_per_key or offered >= 2 * self.variants_per_key
+
+    def add(self, key: GreetingKey, greeting: str, created_at: Optional[float] = None, complete: bool = False):
+        """Offer a greeting for ``key``'s pool; ``complete`` marks the pool as ready to serve whatever its size."""
+        greeting = greeting.strip()
+        if not greeting:
+            return
+        with self._lock:
+            variants, created, offered = self._entries.pop(key, ([], created_at or time.time(), 0))
+            if greeting not in variants and len(variants) < self.variants_per_key:
+                variants.append(greeting)
+            offered = max(offered + 1, 2 * self.variants_per_key if complete else 0)
+            self._entries[key] = (variants, created, offered)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+    def load(self, path: str) -> int:
+        """Load greetings written by ``warm``; entries keep their original age for the TTL."""
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+        for entry in entries:
+            for greeting in entry['greetings']:
+                # warm() already made its attempts: serve the pool even if it came up short
+                self.add(tuple(entry['key']), greeting, created_at=entry.get('created_at'), complete=True)
+        return len(entries)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'keys': len(self._entries), 'hits': self.hits, 'misses': self.misses,
+                    'variants_per_key': self.variants_per_key, 'max_keys': self.max_keys}
+
+
+def generate_greeting(llm, context: Dict) -> str:
+    message = (prompt | llm).invoke({'system': [system_message(context)], 'history': [], 'input': GREETING_INSTRUCTION})
+    return str(message.content).strip()
+
+
+def warm(llm, contexts: Iterable[Dict], variants_per_key: int = 3) -> List[Dict]:
+    entries = []
+    for context in contexts:
+        greetings = []
+        for _ in range(variants_per_key * 2):
+            greeting = generate_greeting(llm, context)
+            if greeting and greeting not in greetings:
+                greetings.append(greeting)
+            if len(greetings) == variants_per_key:
+                break
+        entries.append({'key': list(greeting_key(context)), 'greetings': greetings, 'created_at': time.time()})
+        if len(greetings) < variants_per_key:
+            print(f"Warning: only {len(greetings)} distinct greetings out of {variants_per_key} for {context}, "
+                  f"the pool will be served with fewer variants")
+        else:
+            print(f"Warmed {context}: {len(greetings)} greetings")
+    return entries
+
+
+if __name__ == '__main__':
+    # Usage: python greetings.py contexts.json greetings.json
+    # contexts.json is a list of {"state", "mood", "location", "topic", "language"} objects;
+    # point GREETINGS_FILE at the output to preload it in the API.
+    from dotenv import load_dotenv
+
+    if len(sys.argv) != 3:
+        print("Usage: python greetings.py contexts.json greetings.json")
+        sys.exit(1)
+    load_dotenv()
+    # Imported after load_dotenv so LLM_MODEL and the client settings come from .env
+    from llm_client import create_llm
+    with open(sys.argv[1], encoding='utf-8') as f:
+        contexts = json.load(f)
+    variants = int(os.environ.get('GREETING_CACHE_VARIANTS', 3))
+    entries = warm(create_llm(temperature=1), contexts, variants)
+    with open(sys.argv[2], 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,173 @@
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.memory import BaseMemory
+
+# Conversation history with a hard token budget. Recent messages are kept
+# verbatim; older ones are folded into a running summary that is updated
+# incrementally, so each compaction only pays for the messages it removes.
+#
+# Messages are [role, content, tokens]; the token count is computed once and
+# travels with the message. Entries without it (older sessions) get it on
+# first use.
+
+HISTORY_TOKEN_BUDGET = int(os.environ.get('HISTORY_TOKEN_BUDGET', 2000))
+HISTORY_KEEP_MESSAGES = int(os.environ.get('HISTORY_KEEP_MESSAGES', 4))
+# Compact down to this share of the budget so the summary isn't rewritten every turn
+COMPACTION_TARGET = 0.75
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+SUMMARY_TEMPLATE = """Progressively summarize the conversation between a user and Coopleo, a couple relationship advisor, adding onto the previous summary and returning a new summary.
+Keep the user's name, the facts they shared about their relationship, their feelings and any advice already given. Write in the language of the conversation, in at most 150 words.
+
+Previous summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+
+
+def estimate_tokens(text: str) -> int:
+    # Anthropic has no local tokenizer; ~4 characters per token is close enough for budgeting
+    return max(1, (len(text) + 3) // 4)
+
+
+def message_tokens(message: List) -> int:
+    if len(message) < 3:
+        message.append(estimate_tokens(message[1]))
+    return message[2]
+
+
+def history_tokens(state: Dict) -> int:
+    return state.get('summary_tokens', 0) + sum(message_tokens(m) for m in state['messages'])
+
+
+def format_lines(messages: List[List]) -> str:
+    return '\n'.join(f"{'Human' if m[0] == 'human' else 'AI'}: {m[1]}" for m in messages)
+
+
+def summarizer(llm) -> Callable[[str, List[List]], str]:
+    def summarize(summary: str, messages: List[List]) -> str:
+        result = llm.invoke(SUMMARY_TEMPLATE.format(summary=summary or '(none)', lines=format_lines(messages)))
+        return str(result.content).strip()
+    return summarize
+
+
+class CompactionMetrics:
+    """Prompt history size per turn, before and after compaction."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.compactions = 0
+        self.messages_folded = 0
+        self.tokens_before_total = 0
+        self.tokens_after_total = 0
+        self.tokens_before_max = 0
+        self.tokens_after_max = 0
+        self.last: Dict[str, int] = {}
+
+    def record(self, before: int, after: int, folded: int):
+        with self._lock:
+            self.turns += 1
+            self.compactions += 1 if folded else 0
+            self.messages_folded += folded
+            self.tokens_before_total += before
+            self.tokens_after_total += after
+            self.tokens_before_max = max(self.tokens_before_max, before)
+            self.tokens_after_max = max(self.tokens_after_max, after)
+            self.last = {'tokens_before': before, 'tokens_after': after, 'messages_folded': folded}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            turns = self.turns or 1
+            return {
+                'turns': self.turns,
+                'compactions': self.compactions,
+                'messages_folded': self.messages_folded,
+                'avg_tokens_before': self.tokens_before_total / turns,
+                'avg_tokens_after': self.tokens_after_total / turns,
+                'max_tokens_before': self.tokens_before_max,
+                'max_tokens_after': self.tokens_after_max,
+                'last': self.last,
+            }
+
+
+compaction_metrics = CompactionMetrics()
+
+
+def compact_history(state: Dict, summarize: Callable[[str, List[List]], str], budget: int = HISTORY_TOKEN_BUDGET,
+                    keep_messages: int = HISTORY_KEEP_MESSAGES, base_tokens: int = 0) -> Dict:
+    """Fold the oldest messages of ``state`` into its summary until it fits ``budget``.
+
+    ``state`` holds 'messages' and optionally 'summary'/'summary_tokens' (a
+    session dict works as is). ``base_tokens`` is the fixed part of the prompt
+    (system template, current input); it is only used for the reported sizes.
+    """
+    messages = state['messages']
+    before = history_tokens(state)
+    folded = 0
+    if before > budget:
+        target = budget * COMPACTION_TARGET
+        total = before
+        while total > target and len(messages) - folded > keep_messages:
+            total -= message_tokens(messages[folded])
+            folded += 1
+        # Fold whole exchanges so the kept history still starts with the user
+        if folded % 2 and len(messages) - folded > keep_messages:
+            folded += 1
+        elif folded % 2:
+            folded -= 1
+    if folded:
+        state['summary'] = summarize(state.get('summary', ''), messages[:folded])
+        state['summary_tokens'] = estimate_tokens(state['summary'])
+        del messages[:folded]
+    after = history_tokens(state)
+    compaction_metrics.record(base_tokens + before, base_tokens + after, folded)
+    return {'tokens_before': base_tokens + before, 'tokens_after': base_tokens + after, 'messages_folded': folded}
+
+
+class TokenBudgetMemory(BaseMemory):
+    """Drop-in replacement for a string ConversationBufferMemory with a token budget.
+
+    One instance is shared by concurrent requests whose saves run on executor
+    threads, so reads and saves (including the compaction) hold ``_lock``.
+    """
+
+    llm: Any
+    memory_key: str = "chat_history"
+    input_key: Optional[str] = None
+    budget: int = HISTORY_TOKEN_BUDGET
+    keep_messages: int = HISTORY_KEEP_MESSAGES
+    state: Dict = {}
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.state = {'messages': [], 'summary': '', 'summary_tokens': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, str]:
+        with self._lock:
+            lines = format_lines(self.state['messages'])
+            if self.state['summary']:
+                lines = SUMMARY_PREFIX + self.state['summary'] + '\n' + lines
+        return {self.memory_key: lines}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        input_key = self.input_key or next(k for k in inputs if k != self.memory_key)
+        with self._lock:
+            self.state['messages'].append(['human', str(inputs[input_key])])
+            self.state['messages'].append(['ai', str(next(iter(outputs.values())))])
+            compact_history(self.state, summarizer(self.llm), self.budget, self.keep_messages)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.state = {'messages': [], 'summary': '', 'summary_tokens': 0}
@@ -0,0 +1,103 @@
+"""Duplicate /api/chat submissions (client retries, double clicks).
+
+A request is identified by the client's Idempotency-Key when it sends one,
+otherwise by a hash of conversation id, message and turn number. The first
+request with a key computes the reply; identical requests arriving meanwhile
+wait for it instead of calling the LLM again. Replies to client keys are
+also stored, and repeats within ``ttl_seconds`` get the stored reply. Only
+successful replies are stored.
+
+Without a client key only requests that overlap are merged: once a reply is
+done, the same message again is a new turn (users often answer "oui" twice
+in a row). Clients that retry after a timeout should send a key per message.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+def request_key(conversation_id: Optional[str], message: Any = None, turn: Optional[int] = None,
+                client_key: Optional[str] = None) -> str:
+    if client_key:
+        parts = ['client', conversation_id or '', client_key]
+    else:
+        if not isinstance(message, str):
+            message = json.dumps(message, sort_keys=True)
+        parts = ['derived', conversation_id or '', message, str(turn)]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class Flight:
+    def __init__(self):
+        self.result: Optional[Dict] = None
+        self._done = threading.Event()
+
+    def wait(self, timeout: float) -> Optional[Dict]:
+        """The first request's reply, or None if it failed or took longer than ``timeout``."""
+        self._done.wait(timeout)
+        return self.result
+
+    def finish(self, result: Optional[Dict]):
+        self.result = result
+        self._done.set()
+
+
+class IdempotentResponses:
+    """Single-flight computations plus a bounded TTL cache of their results, by request key."""
+
+    def __init__(self, ttl_seconds: float = 30, max_entries: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.replayed = 0
+        self.coalesced = 0
+        self.computed = 0
+        self._results: "OrderedDict[str, Tuple[Dict, float]]" = OrderedDict()
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key: str, earlier_key: Optional[str] = None):
+        """Decide how to handle a request.
+
+        Returns ``('cached', result)``, ``('wait', flight)`` when an identical
+        request is in flight, or ``('lead', flight)`` when this request must
+        compute the reply and then call ``finish``. ``earlier_key`` names the
+        same request as seen before the previous turn was committed; it only
+        matches while that request is still in flight.
+        """
+        with self._lock:
+            entry = self._results.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._results.move_to_end(key)
+                    self.replayed += 1
+                    return 'cached', entry[0]
+                del self._results[key]
+            for candidate in (earlier_key, key):
+                flight = self._flights.get(candidate) if candidate is not None else None
+                if flight is not None:
+                    self.coalesced += 1
+                    return 'wait', flight
+            flight = self._flights[key] = Flight()
+            self.computed += 1
+            return 'lead', flight
+
+    def finish(self, key: str, result: Optional[Dict], remember: bool = True):
+        """Hand ``result`` to the waiting requests, and keep it for ``ttl_seconds`` if ``remember``."""
+        with self._lock:
+            flight = self._flights.pop(key, None)
+            if result is not None and remember:
+                self._results[key] = (result, time.monotonic() + self.ttl_seconds)
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        if flight is not None:
+            flight.finish(result)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._results), 'in_flight': len(self._flights), 'max_entries': self.max_entries,
+                    'ttl_seconds': self.ttl_seconds, 'computed': self.computed, 'replayed': self.replayed,
+                    'coalesced': self.coalesced}
@@ -0,0 +1,97 @@
+"""The Anthropic chat model shared by every request in the process.
+
+ChatAnthropic normally builds its HTTP clients lazily with httpx defaults. Here
+they are created up front on one pooled httpx client per API URL, so every
+session, chain and helper reuses the same kept-alive connections.
+Pool limits come from the environment:
+
+    LLM_MAX_CONNECTIONS            max open connections (default 20)
+    LLM_MAX_KEEPALIVE_CONNECTIONS  idle connections kept open (default 10)
+    LLM_KEEPALIVE_EXPIRY           seconds an idle connection is kept (default 30)
+"""
+import os
+from functools import lru_cache
+
+LLM_MODEL = os.environ.get('LLM_MODEL', 'claude-3-sonnet-20240229')
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 60))  # seconds per request
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 2))
+LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', 20))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('LLM_MAX_KEEPALIVE_CONNECTIONS', 10))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get('LLM_KEEPALIVE_EXPIRY', 30))
+# Chain logging prints every full prompt; only turn it on to debug
+LLM_VERBOSE = os.environ.get('LLM_VERBOSE', 'false').lower() in ('1', 'true', 'yes')
+
+DEFAULT_API_URL = 'https://api.anthropic.com'
+
+
+def pool_limits():
+    import httpx
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+    )
+
+
+@lru_cache(maxsize=None)
+def http_client(base_url: str):
+    import anthropic
+    return anthropic.DefaultHttpxClient(base_url=base_url, timeout=LLM_TIMEOUT, limits=pool_limits())
+
+
+@lru_cache(maxsize=None)
+def async_http_client(base_url: str):
+    import anthropic
+    return anthropic.DefaultAsyncHttpxClient(base_url=base_url, timeout=LLM_TIMEOUT, limits=pool_limits())
+
+
+def usage_callback(on_usage):
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class UsageCallback(BaseCallbackHandler):
+        # Called in the caller's context, so on_usage sees the request's context variables
+        run_inline = True
+
+        def on_llm_end(self, response, **kwargs):
+            for generations in response.generations:
+                for generation in generations:
+                    on_usage(getattr(getattr(generation, 'message', None), 'usage_metadata', None))
+
+    return UsageCallback()
+
+
+def create_llm(on_usage=None, **kwargs):
+    """Return a ChatAnthropic model whose sync and async clients use the shared pools.
+
+    ``on_usage(usage_metadata)`` is called after every LLM call made with the model.
+    """
+    import anthropic
+    from langchain_anthropic import ChatAnthropic
+
+    if on_usage is not None:
+        kwargs['callbacks'] = list(kwargs.get('callbacks') or []) + [usage_callback(on_usage)]
+    llm = ChatAnthropic(
+        model=kwargs.pop('model', LLM_MODEL),
+        default_request_timeout=LLM_TIMEOUT,
+        max_retries=LLM_MAX_RETRIES,
+        **kwargs
+    )
+    params = llm._client_params
+    base_url = params['base_url'] or os.environ.get('ANTHROPIC_BASE_URL') or DEFAULT_API_URL
+    # Both clients are cached properties on the model; filling them in here keeps
+    # ChatAnthropic from building its own with the httpx default limits
+    llm.__dict__['_client'] = anthropic.Client(**params, http_client=http_client(base_url))
+    llm.__dict__['_async_client'] = anthropic.AsyncClient(**params, http_client=async_http_client(base_url))
+    return llm
+
+
+def warm_connections(llm) -> bool:
+    """Open a kept-alive connection to the API so the first turn skips the TCP and TLS handshake."""
+    try:
+        base_url = llm._client_params['base_url'] or os.environ.get('ANTHROPIC_BASE_URL') or DEFAULT_API_URL
+        # Any response will do, the connection stays in the pool afterwards
+        http_client(base_url).head('/', timeout=5)
+        return True
+    except Exception as e:
+        print(f"Failed to warm LLM connections: {str(e)}")
+        return False
@@ -0,0 +1,171 @@
+"""Always-on request metrics, exposed in the Prometheus text format.
+
+Stage latencies go to one histogram labelled by stage (session_lookup,
+prompt_render, llm_call, suggestions, retry_sleep, ...). LLM tokens are
+counted per endpoint and kind (input, output, cached, cache_write). Each
+request gets an ID, taken from the X-Request-ID header when the caller sends
+one, which is echoed back and available to log lines via current_request_id().
+
+Recording is a lock, a bisect and a few integer updates, so it is cheap
+enough to leave on. This module has no dependencies; the Flask and FastAPI
+apps each serve render() from their own metrics endpoint. Values are per
+process: scrape each instance.
+"""
+import contextvars
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Seconds; wide enough for LLM calls, fine enough for in-memory lookups
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+
+request_id_var = contextvars.ContextVar('request_id', default='-')
+endpoint_var = contextvars.ContextVar('endpoint', default='other')
+
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(values):
+            yield f'{self.name}{format_labels(self.labels, labels)} {value:g}'
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [count per bucket (last one is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, counts, total, count in sorted(series):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound:g}"'
+                yield f'{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{format_labels(self.labels, labels)} {total:.6f}'
+            yield f'{self.name}_count{format_labels(self.labels, labels)} {count}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram('coopleo_stage_seconds', 'Time spent in each stage of a request', ('stage',))
+request_seconds = registry.histogram('coopleo_request_seconds', 'Request latency by endpoint', ('endpoint', 'method', 'status'))
+llm_tokens = registry.counter('coopleo_llm_tokens_total', 'LLM tokens by endpoint and kind', ('endpoint', 'kind'))
+llm_calls = registry.counter('coopleo_llm_calls_total', 'LLM calls by endpoint', ('endpoint',))
+requests_shed = registry.counter('coopleo_requests_shed_total', 'Chat requests turned away by reason', ('reason',))
+idempotent_replays = registry.counter('coopleo_idempotent_replays_total', 'Duplicate chat requests answered without a new LLM call', ('kind',))
+breaker_transitions = registry.counter('coopleo_llm_breaker_transitions_total', 'LLM circuit breaker state changes', ('state',))
+
+
+@contextmanager
+def timed(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - started, stage)
+
+
+def observe_stage(stage: str, seconds: float):
+    stage_seconds.observe(seconds, stage)
+
+
+def record_tokens(usage: Optional[Dict]):
+    """Count one LLM call from its LangChain ``usage_metadata``."""
+    endpoint = endpoint_var.get()
+    llm_calls.inc(1, endpoint)
+    if not usage:
+        return
+    details = usage.get('input_token_details') or {}
+    for kind, value in (('input', usage.get('input_tokens')), ('output', usage.get('output_tokens')),
+                        ('cached', details.get('cache_read')), ('cache_write', details.get('cache_creation'))):
+        if value:
+            llm_tokens.inc(value, endpoint, kind)
+
+
+def start_request(endpoint: str, request_id: Optional[str] = None) -> str:
+    """Tag the current context with an endpoint and a request ID, reusing the caller's ID if it looks sane."""
+    if not request_id or not VALID_REQUEST_ID.match(request_id):
+        request_id = uuid.uuid4().hex
+    request_id_var.set(request_id)
+    endpoint_var.set(endpoint)
+    return request_id
+
+
+def finish_request(endpoint: str, method: str, status: int, seconds: float):
+    request_seconds.observe(seconds, endpoint, method, str(status))
+
+
+def current_request_id() -> str:
+    return request_id_var.get()
+
+
+def render() -> str:
+    return registry.render()
@@ -0,0 +1,225 @@
+"""Keeping /api/chat responsive when the LLM provider slows down or fails.
+
+* SessionLocks serializes requests for one conversation, so concurrent
+  messages can't interleave their read-modify-write of the session.
+* AdmissionControl caps the chat requests in flight and the queue behind
+  them; anything beyond is shed at once instead of tying up a worker.
+* CircuitBreaker stops calling the LLM after repeated failures and lets a
+  single trial call through once ``reset_timeout`` has passed.
+* backoff_delay gives exponential backoff with full jitter for retries.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+
+class Rejected(Exception):
+    """Request turned away; ``status`` and ``retry_after`` (seconds) are meant for the HTTP response."""
+
+    def __init__(self, message: str, status: int, retry_after: float, reason: str):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class CircuitOpen(Rejected):
+    def __init__(self, retry_after: float):
+        super().__init__('The AI service is temporarily unavailable, please retry shortly', 503, retry_after, 'circuit_open')
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full jitter: a random delay up to base * 2**attempt, capped at ``cap``."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class Lease:
+    """Releases whatever was acquired for a request, once, when the response is done."""
+
+    def __init__(self):
+        self._releases = []
+        self._lock = threading.Lock()
+
+    def add(self, release: Callable[[], None]):
+        self._releases.append(release)
+
+    def release(self):
+        with self._lock:
+            releases, self._releases = self._releases, []
+        for release in reversed(releases):
+            release()
+
+    def wrap(self, stream):
+        # For streamed responses: hold until the last chunk is sent or the client goes away
+        try:
+            yield from stream
+        finally:
+            self.release()
+
+
+class SessionLocks:
+    """One lock per conversation id, dropped again when nobody holds or waits for it."""
+
+    def __init__(self, timeout: float = 30):
+        self.timeout = timeout
+        self._locks: Dict[str, list] = {}  # conversation id -> [lock, holders and waiters]
+        self._lock = threading.Lock()
+
+    def acquire(self, conversation_id: str) -> Callable[[], None]:
+        """Wait for the conversation's lock; returns the function that releases it."""
+        with self._lock:
+            entry = self._locks.setdefault(conversation_id, [threading.Lock(), 0])
+            entry[1] += 1
+        if not entry[0].acquire(timeout=self.timeout):
+            self._drop(conversation_id, entry)
+            raise Rejected('Another message for this conversation is still being processed', 409, self.timeout, 'session_busy')
+
+        def release():
+            entry[0].release()
+            self._drop(conversation_id, entry)
+        return release
+
+    def _drop(self, conversation_id: str, entry: list):
+        with self._lock:
+            entry[1] -= 1
+            if entry[1] == 0 and self._locks.get(conversation_id) is entry:
+                del self._locks[conversation_id]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'active_sessions': len(self._locks), 'timeout_seconds': self.timeout}
+
+
+class AdmissionControl:
+    """At most ``max_concurrent`` requests run; up to ``max_queue`` more wait ``queue_timeout`` seconds for a slot.
+
+    A full queue is answered with 429 straight away; a wait that runs out
+    with 503.
+    """
+
+    def __init__(self, max_concurrent: int = 16, max_queue: int = 64, queue_timeout: float = 10):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self.shed = {'queue_full': 0, 'queue_timeout': 0}
+        self._cond = threading.Condition()
+
+    def acquire(self) -> Callable[[], None]:
+        with self._cond:
+            if self.in_flight >= self.max_concurrent:
+                if self.queued >= self.max_queue:
+                    self.shed['queue_full'] += 1
+                    raise Rejected('Too many requests, please retry shortly', 429, 1, 'queue_full')
+                self.queued += 1
+                try:
+                    admitted = self._cond.wait_for(lambda: self.in_flight < self.max_concurrent, self.queue_timeout)
+                finally:
+                    self.queued -= 1
+                if not admitted:
+                    self.shed['queue_timeout'] += 1
+                    raise Rejected('The service is busy, please retry shortly', 503, self.queue_timeout, 'queue_timeout')
+            self.in_flight += 1
+        return self._release
+
+    def _release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {'in_flight': self.in_flight, 'queued': self.queued, 'max_concurrent': self.max_concurrent,
+                    'max_queue': self.max_queue, 'shed': dict(self.shed)}
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures.
+
+    While open, calls fail fast with CircuitOpen. After ``reset_timeout``
+    seconds one trial call is let through (half open): its success closes the
+    breaker, its failure opens it again. Exceptions in ``ignore`` (bad model
+    output rather than a provider problem) don't count either way.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30, ignore: Tuple[type, ...] = (),
+                 on_state_change: Optional[Callable[[str], None]] = None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.ignore = ignore
+        self.on_state_change = on_state_change
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str):
+        # Caller holds the lock
+        if state != self.state:
+            self.state = state
+            if self.on_state_change:
+                self.on_state_change(state)
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'closed':
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self._trial:
+                raise CircuitOpen(max(remaining, 1))
+            self._set_state('half_open')
+            self._trial = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial = False
+            self._set_state('closed')
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state('open')
+
+    def _release_trial(self):
+        with self._lock:
+            self._trial = False
+
+    @contextmanager
+    def guard(self):
+        self.before_call()
+        outcome = None
+        try:
+            yield
+            outcome = 'success'
+        except self.ignore:
+            raise
+        except Exception:
+            outcome = 'failure'
+            raise
+        finally:
+            if outcome == 'success':
+                self.record_success()
+            elif outcome == 'failure':
+                self.record_failure()
+            else:
+                # Ignored error or abandoned stream: no verdict, let the next call try
+                self._release_trial()
+
+    def wrap(self, func: Callable) -> Callable:
+        def guarded(*args, **kwargs):
+            with self.guard():
+                return func(*args, **kwargs)
+        return guarded
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self.failures,
+                    'failure_threshold': self.failure_threshold, 'reset_timeout_seconds': self.reset_timeout}
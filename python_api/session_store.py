@@ -0,0 +1,361 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, JSON is used when it is missing
+    msgpack = None
+
+# A session is kept as plain data only: the message list, the user context, the
+# turn counter and a version used for optimistic concurrency between workers.
+# The prompt history for a turn is built from it (turn_executor.history_messages).
+#
+#   {'messages': [[role, content, tokens], ...], 'context': {...}, 'message_count': int, 'version': int,
+#    'summary': str, 'summary_tokens': int}
+#
+# 'summary' holds the turns folded out of 'messages' by history.compact_history.
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 6 * 60 * 60
+DEFAULT_PURGE_EVERY = 500  # SQLite: delete expired rows once per this many writes
+MAX_COMMIT_ATTEMPTS = 5
+
+
+class VersionConflict(Exception):
+    pass
+
+
+def new_session(context: Optional[Dict] = None) -> Dict:
+    return {'messages': [], 'context': context or {}, 'message_count': 0, 'version': 0}
+
+
+def encode_session(session: Dict) -> bytes:
+    if msgpack is not None:
+        return msgpack.packb(session, use_bin_type=True)
+    return json.dumps(session, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def decode_session(payload: bytes) -> Dict:
+    # JSON payloads always start with '{', msgpack maps never do.
+    if payload[:1] == b'{':
+        return json.loads(payload.decode('utf-8'))
+    if msgpack is None:
+        raise ValueError('Session was written with msgpack, which is not installed')
+    return msgpack.unpackb(payload, raw=False)
+
+
+class SessionStore(ABC):
+    """Interface shared by the session backends.
+
+    ``put`` only succeeds when the stored version still matches
+    ``session['version']``; otherwise it raises ``VersionConflict`` so the
+    caller can reload and reapply its change instead of overwriting another
+    worker's turn.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @abstractmethod
+    def get(self, session_id: Optional[str]) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def put(self, session_id: str, session: Dict):
+        ...
+
+    @abstractmethod
+    def delete(self, session_id: Optional[str]) -> bool:
+        ...
+
+    def stats(self) -> Dict:
+        return {'backend': type(self).__name__, 'hits': self.hits, 'misses': self.misses}
+
+    def commit_turn(self, session_id: str, session: Dict, new_messages: List[List[str]]) -> Dict:
+        """Persist one turn, replaying it onto the latest version on conflict."""
+        for _ in range(MAX_COMMIT_ATTEMPTS):
+            try:
+                self.put(session_id, session)
+                return session
+            except VersionConflict:
+                latest = self.get(session_id)
+                if latest is None:
+                    # Expired or evicted meanwhile: this copy already holds the full history.
+                    session['version'] = 0
+                    continue
+                latest['messages'].extend(new_messages)
+                latest['message_count'] += 1
+                latest['context'] = session['context']
+                session = latest
+        raise VersionConflict(f'Could not save conversation {session_id} after {MAX_COMMIT_ATTEMPTS} attempts')
+
+
+class MemorySessionStore(SessionStore):
+    """In-process session store with LRU and idle-TTL eviction.
+
+    Sessions are stored encoded, so the byte budget reflects what is actually
+    held in memory rather than a guess at Python object sizes.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, session_id: Optional[str]) -> Optional[Dict]:
+        if not session_id:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            payload, last_access, version = entry
+            if self.ttl_seconds and now - last_access > self.ttl_seconds:
+                self._remove(session_id)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries[session_id] = (payload, now, version)
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+        return decode_session(payload)
+
+    def put(self, session_id: str, session: Dict):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            current_version = entry[2] if entry else 0
+            if current_version != session['version']:
+                raise VersionConflict(session_id)
+            session['version'] += 1
+            payload = encode_session(session)
+            if entry:
+                self._remove(session_id)
+            self._entries[session_id] = (payload, time.monotonic(), session['version'])
+            self._bytes += len(payload)
+            self._evict()
+
+    def delete(self, session_id: Optional[str]) -> bool:
+        with self._lock:
+            if session_id in self._entries:
+                self._remove(session_id)
+                return True
+            return False
+
+    def __contains__(self, session_id) -> bool:
+        with self._lock:
+            return session_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                **super().stats(),
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _remove(self, session_id: str):
+        payload = self._entries.pop(session_id)[0]
+        self._bytes -= len(payload)
+
+    def _evict(self):
+        now = time.monotonic()
+        # Idle sessions sit at the front of the LRU order, so expiry can stop
+        # at the first one that is still fresh.
+        while self._entries and self.ttl_seconds:
+            session_id, (_, last_access, _) = next(iter(self._entries.items()))
+            if now - last_access <= self.ttl_seconds:
+                break
+            self._remove(session_id)
+            self.expirations += 1
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            payload = self._entries.popitem(last=False)[1][0]
+            self._bytes -= len(payload)
+            self.evictions += 1
+
+
+class SQLiteSessionStore(SessionStore):
+    """Session store shared by all workers on one host through a WAL-mode SQLite file.
+
+    Expired rows are deleted at startup and then once every ``purge_every``
+    writes from this process, so the file doesn't grow with every session
+    ever seen.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = DEFAULT_TTL_SECONDS, purge_every: int = DEFAULT_PURGE_EVERY):
+        super().__init__()
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.purge_every = purge_every
+        self.purged = 0
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'id TEXT PRIMARY KEY, version INTEGER NOT NULL, payload BLOB NOT NULL, updated_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)')
+        self.purge_expired()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id: Optional[str]) -> Optional[Dict]:
+        if not session_id:
+            return None
+        row = self._connection().execute(
+            'SELECT payload, updated_at FROM sessions WHERE id = ?', (session_id,)
+        ).fetchone()
+        if row is None or (self.ttl_seconds and time.time() - row[1] > self.ttl_seconds):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return decode_session(row[0])
+
+    def put(self, session_id: str, session: Dict):
+        expected = session['version']
+        session['version'] = expected + 1
+        payload = encode_session(session)
+        conn = self._connection()
+        if expected == 0:
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO sessions (id, version, payload, updated_at) VALUES (?, 1, ?, ?)',
+                (session_id, payload, time.time())
+            )
+        else:
+            cursor = conn.execute(
+                'UPDATE sessions SET version = version + 1, payload = ?, updated_at = ? WHERE id = ? AND version = ?',
+                (payload, time.time(), session_id, expected)
+            )
+        if cursor.rowcount != 1:
+            session['version'] = expected
+            raise VersionConflict(session_id)
+        with self._writes_lock:
+            self._writes += 1
+            due = self.purge_every and self._writes % self.purge_every == 0
+        if due:
+            self.purge_expired()
+
+    def delete(self, session_id: Optional[str]) -> bool:
+        cursor = self._connection().execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+        return cursor.rowcount > 0
+
+    def purge_expired(self) -> int:
+        if not self.ttl_seconds:
+            return 0
+        cursor = self._connection().execute(
+            'DELETE FROM sessions WHERE updated_at < ?', (time.time() - self.ttl_seconds,)
+        )
+        with self._writes_lock:
+            self.purged += cursor.rowcount
+        return cursor.rowcount
+
+    def stats(self) -> Dict:
+        entries, size = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM sessions'
+        ).fetchone()
+        return {**super().stats(), 'entries': entries, 'bytes': size, 'ttl_seconds': self.ttl_seconds,
+                'purge_every': self.purge_every, 'purged': self.purged}
+
+
+class RedisSessionStore(SessionStore):
+    """Session store for any server speaking the Redis protocol.
+
+    ``client`` is a redis-py compatible client; a local stand-in such as
+    fakeredis works for development.
+    """
+
+    def __init__(self, client, ttl_seconds: float = DEFAULT_TTL_SECONDS, prefix: str = 'coopleo:session:'):
+        super().__init__()
+        from redis.exceptions import WatchError
+        self._watch_error = WatchError
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def _key(self, session_id: str) -> str:
+        return self.prefix + session_id
+
+    def get(self, session_id: Optional[str]) -> Optional[Dict]:
+        if not session_id:
+            return None
+        payload = self.client.get(self._key(session_id))
+        if payload is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return decode_session(payload)
+
+    def put(self, session_id: str, session: Dict):
+        key = self._key(session_id)
+        expected = session['version']
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                current = pipe.get(key)
+                current_version = decode_session(current)['version'] if current is not None else 0
+                if current_version != expected:
+                    raise VersionConflict(session_id)
+                session['version'] = expected + 1
+                pipe.multi()
+                pipe.set(key, encode_session(session), ex=int(self.ttl_seconds) or None)
+                pipe.execute()
+            except self._watch_error:
+                session['version'] = expected
+                raise VersionConflict(session_id)
+
+    def delete(self, session_id: Optional[str]) -> bool:
+        if not session_id:
+            return False
+        return bool(self.client.delete(self._key(session_id)))
+
+
+def create_session_store() -> SessionStore:
+    backend = os.environ.get('SESSION_BACKEND', 'memory')
+    ttl_seconds = float(os.environ.get('SESSION_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+    if backend == 'sqlite':
+        return SQLiteSessionStore(os.environ.get('SESSION_SQLITE_PATH', 'sessions.db'), ttl_seconds=ttl_seconds,
+                                  purge_every=int(os.environ.get('SESSION_SQLITE_PURGE_EVERY', DEFAULT_PURGE_EVERY)))
+    if backend == 'redis':
+        import redis
+        return RedisSessionStore(redis.Redis.from_url(os.environ.get('REDIS_URL', 'redis://localhost:6379/0')),
+                                 ttl_seconds=ttl_seconds)
+    if backend != 'memory':
+        raise ValueError(f'Unknown SESSION_BACKEND: {backend}')
+    return MemorySessionStore(
+        max_entries=int(os.environ.get('SESSION_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+        max_bytes=int(os.environ.get('SESSION_MAX_BYTES', DEFAULT_MAX_BYTES)),
+        ttl_seconds=ttl_seconds,
+    )
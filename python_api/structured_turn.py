@@ -0,0 +1,55 @@
+from typing import Any, Dict, List, Tuple
+
+from pydantic import BaseModel, Field, field_validator
+
+# Appended to the user's turn when the reply, suggestions and flags are
+# requested from a single model call.
+STRUCTURED_INSTRUCTIONS = """
+
+Return your answer through the structured output tool:
+- reply: your single response to the user, following every rule above.
+- suggestions: exactly 3 short, natural examples (2 to 10 words each) of what the user might say next, in the user's language, without numbering or ellipsis. Leave empty when giving final recommendations.
+- contains_recommendations: true only if the reply gives the final recommendations.
+- asks_for_email: true only if the reply asks whether the user wants the recommendations by email.
+- final_recommendations: the recommendation bullets of the reply, without the bullet sign. Leave empty otherwise."""
+
+
+class TurnResult(BaseModel):
+    """One chat turn: the advisor's reply plus the UI hints derived from it."""
+
+    reply: str = Field(description="The advisor's response shown to the user")
+    suggestions: List[str] = Field(default_factory=list, description="3 short examples of what the user might say next")
+    contains_recommendations: bool = Field(default=False, description="Whether the reply gives the final recommendations")
+    asks_for_email: bool = Field(default=False, description="Whether the reply offers to send the recommendations by email")
+    final_recommendations: List[str] = Field(default_factory=list, description="The recommendation bullets, without the bullet sign")
+
+    @field_validator('reply')
+    @classmethod
+    def reply_not_empty(cls, value: str) -> str:
+        if not value.strip():
+            raise ValueError('reply is empty')
+        return value.strip()
+
+    @field_validator('suggestions')
+    @classmethod
+    def clean_suggestions(cls, value: List[str]) -> List[str]:
+        suggestions = [s.strip() for s in value if s.strip()]
+        suggestions = [s for s in suggestions if 2 <= len(s.split()) <= 10 and not s.startswith('(')]
+        return suggestions[:3]
+
+    @field_validator('final_recommendations')
+    @classmethod
+    def clean_recommendations(cls, value: List[str]) -> List[str]:
+        return [rec.strip().lstrip('•-* ').strip() for rec in value if rec.strip()]
+
+
+def run_structured_turn(prompt, llm, variables: Dict) -> Tuple[TurnResult, Any]:
+    """Return the validated result and the raw model message (for token usage)."""
+    chain = prompt | llm.with_structured_output(TurnResult, include_raw=True)
+    output = chain.invoke({**variables, 'input': variables['input'] + STRUCTURED_INSTRUCTIONS})
+    if output.get('parsing_error'):
+        raise output['parsing_error']
+    result = output['parsed']
+    if not isinstance(result, TurnResult):
+        result = TurnResult.model_validate(result)
+    return result, output['raw']
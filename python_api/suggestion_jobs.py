@@ -0,0 +1,76 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class SuggestionJobs:
+    """Background suggestion generation, one pending job per conversation.
+
+    Submitting a job for a conversation cancels the previous one: a job that
+    has not started is dropped, a running one sees its ``cancelled`` event set
+    and its result is ignored.
+    """
+
+    def __init__(self, fallback: List[str], max_workers: int = 4, timeout: float = 15, retention: float = 300):
+        self.fallback = fallback
+        self.timeout = timeout
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='suggestions')
+        self._jobs: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, conversation_id: str, func: Callable[..., List[str]], *args):
+        cancelled = threading.Event()
+        # Run in a copy of the caller's context so the job keeps its request ID and endpoint
+        future = self._executor.submit(contextvars.copy_context().run, func, *args, cancelled=cancelled)
+        with self._lock:
+            self._prune()
+            previous = self._jobs.get(conversation_id)
+            self._jobs[conversation_id] = (future, cancelled, time.monotonic())
+        if previous:
+            self._cancel(previous)
+
+    def cancel(self, conversation_id: Optional[str]):
+        with self._lock:
+            job = self._jobs.pop(conversation_id, None)
+        if job:
+            self._cancel(job)
+
+    def result(self, conversation_id: str, wait: float = 0) -> Optional[Tuple[bool, List[str]]]:
+        """Return ``(ready, suggestions)``, or None when no job exists.
+
+        Waits up to ``wait`` seconds for a pending job. A job that failed,
+        returned nothing or ran past ``timeout`` yields the fallback list.
+        """
+        with self._lock:
+            job = self._jobs.get(conversation_id)
+        if job is None:
+            return None
+        future, cancelled, started = job
+        remaining = self.timeout - (time.monotonic() - started)
+        try:
+            suggestions = future.result(timeout=max(0, min(wait, remaining)))
+        except TimeoutError:
+            if remaining > wait:
+                return False, []
+            cancelled.set()
+            print(f"Suggestions for {conversation_id} timed out after {self.timeout} seconds")
+            return True, self.fallback
+        except Exception as e:
+            print(f"Error generating suggestions in background: {str(e)}")
+            return True, self.fallback
+        return True, suggestions or self.fallback
+
+    def _prune(self):
+        # Jobs stay readable for `retention` seconds (longer than `timeout`), then go away
+        now = time.monotonic()
+        for conversation_id, job in list(self._jobs.items()):
+            if now - job[2] > self.retention:
+                self._cancel(self._jobs.pop(conversation_id))
+
+    def _cancel(self, job):
+        future, cancelled, _ = job
+        cancelled.set()
+        future.cancel()
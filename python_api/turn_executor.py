@@ -0,0 +1,63 @@
+"""Stateless execution of one conversation turn.
+
+Nothing here belongs to a session: each call takes the session's history, its
+context and the new input, and returns the model's message. The prompt and
+the shared LLM are reused for every conversation, instead of building a
+ConversationBufferMemory and an LLMChain per request. Rendering the prompt
+and calling the model are timed as separate stages.
+"""
+from contextlib import nullcontext
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from history import SUMMARY_PREFIX
+from metrics import timed
+from prompts import prompt, system_message
+from resilience import CircuitBreaker
+from structured_turn import TurnResult, run_structured_turn
+
+
+def history_messages(session: Dict) -> List[BaseMessage]:
+    """The session's summary and stored messages, as prompt messages."""
+    messages = []
+    if session.get('summary'):
+        messages.append(HumanMessage(content=SUMMARY_PREFIX + session['summary']))
+    # Entries may carry a cached token count as a third element
+    for role, content, *_ in session['messages']:
+        messages.append(HumanMessage(content=content) if role == 'human' else AIMessage(content=content))
+    return messages
+
+
+class TurnExecutor:
+    """Runs turns against the LLM returned by ``get_llm``, through ``breaker`` when given."""
+
+    def __init__(self, get_llm: Callable, breaker: Optional[CircuitBreaker] = None):
+        self.get_llm = get_llm
+        self.breaker = breaker
+
+    def guard(self):
+        return self.breaker.guard() if self.breaker else nullcontext()
+
+    @staticmethod
+    def variables(history: List[BaseMessage], context: Dict, input_message: str) -> Dict:
+        return {'system': [system_message(context)], 'history': history, 'input': input_message}
+
+    def render(self, history: List[BaseMessage], context: Dict, input_message: str):
+        with timed('prompt_render'):
+            return prompt.invoke(self.variables(history, context, input_message))
+
+    def invoke(self, history: List[BaseMessage], context: Dict, input_message: str):
+        rendered = self.render(history, context, input_message)
+        with timed('llm_call'), self.guard():
+            return self.get_llm().invoke(rendered)
+
+    def stream(self, history: List[BaseMessage], context: Dict, input_message: str) -> Iterator:
+        # The caller times the stream; the breaker sees how the whole stream went
+        rendered = self.render(history, context, input_message)
+        with self.guard():
+            yield from self.get_llm().stream(rendered)
+
+    def structured(self, history: List[BaseMessage], context: Dict, input_message: str) -> Tuple[TurnResult, object]:
+        with timed('llm_call'), self.guard():
+            return run_structured_turn(prompt, self.get_llm(), self.variables(history, context, input_message))
@@ -0,0 +1,99 @@
+"""Cold-start benchmark for the Vercel entry point (api/index.py).
+
+Runs `python -X importtime` on a fresh interpreter that imports api.index and
+serves one /api/test request, then prints the slowest imports and checks:
+
+* the cold start stays under --budget-ms, and
+* none of the --forbid packages (langchain by default) were imported.
+
+Exits with status 1 when a check fails, so it can run as a regression check:
+
+    python scripts/bench_import.py --budget-ms 400
+    python scripts/bench_import.py --json > bench_output.json
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+COLD_START = """
+import time
+started = time.perf_counter()
+import api.index
+imported = time.perf_counter()
+response = api.index.app.test_client().get('/api/test')
+assert response.status_code == 200, response.status_code
+print('COLD_START', imported - started, time.perf_counter() - started)
+"""
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+
+def run():
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([ROOT, os.path.join(ROOT, 'python_api')])}
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', COLD_START],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit(f'Cold start failed with status {proc.returncode}')
+
+    imports = []
+    for line in proc.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            imports.append({'module': name, 'self_ms': int(self_us) / 1000,
+                            'cumulative_ms': int(cumulative_us) / 1000, 'depth': len(indent) // 2})
+    import_s, total_s = next(map(float, line.split()[1:]) for line in proc.stdout.splitlines()
+                             if line.startswith('COLD_START'))
+    return {'import_ms': import_s * 1000, 'first_request_ms': total_s * 1000, 'imports': imports}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=400, help='Max import + first /api/test time')
+    parser.add_argument('--forbid', action='append', default=None, help='Top-level package that must not be imported')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest packages to show')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+    forbidden = args.forbid or ['langchain', 'langchain_core', 'langchain_anthropic', 'anthropic']
+
+    result = run()
+    imported = {entry['module'].split('.')[0] for entry in result['imports']}
+    violations = sorted(imported & set(forbidden))
+    # Self time summed per top-level package: where the import time actually goes
+    packages = {}
+    for entry in result['imports']:
+        package = entry['module'].split('.')[0]
+        packages[package] = packages.get(package, 0) + entry['self_ms']
+    slowest = sorted(packages.items(), key=lambda item: -item[1])[:args.top]
+    failed = bool(violations) or result['first_request_ms'] > args.budget_ms
+
+    if args.json:
+        print(json.dumps({
+            'import_ms': round(result['import_ms'], 1),
+            'first_request_ms': round(result['first_request_ms'], 1),
+            'budget_ms': args.budget_ms,
+            'forbidden_imports': violations,
+            'packages_ms': {package: round(ms, 1) for package, ms in slowest},
+            'passed': not failed,
+        }, indent=2))
+    else:
+        print(f"api.index import: {result['import_ms']:.1f} ms, first /api/test response: {result['first_request_ms']:.1f} ms "
+              f"(budget {args.budget_ms:.0f} ms)")
+        print("\nImport time by package:")
+        for package, ms in slowest:
+            print(f"  {ms:9.1f} ms  {package}")
+        if violations:
+            print(f"\nFAIL: health endpoints imported {', '.join(violations)}")
+        elif failed:
+            print("\nFAIL: cold start over budget")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+"""Hermetic load test for the Flask chat API and the FastAPI conversation API.
+
+Everything runs in process: the routes are driven through the Flask test
+client and an ASGI transport, the chat model is a deterministic fake with a
+configurable time to first token and token rate, and Supabase is replaced by
+an in-memory stand-in. No network or API key is needed.
+
+Each simulated session is a realistic 10-turn conversation:
+
+* flask:   initial context (greeting), follow-ups, the final-recommendation
+           turn (10th message), then the session stats
+* fastapi: 10 /chat turns, then /summary and /conversations for the session
+
+The report gives throughput, p50/p95/p99 latency per request kind and RSS
+growth per session, as JSON, so two commits can be compared:
+
+    python scripts/bench_load.py --sessions 200 --concurrency 20 --output before.json
+    python scripts/bench_load.py --sessions 200 --concurrency 20 --compare before.json
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'python_api')]
+
+from tests.support import FakeChatModel, FakeSupabase
+
+TURNS_PER_SESSION = 10
+TARGETS = ('flask', 'fastapi')
+
+CONTEXT = {'topic': 'communication', 'mood': 'inquiet', 'partner': 'Sam'}
+USER_MESSAGES = [
+    "Je m'appelle Alex",
+    "Nous nous disputons souvent pour des petites choses",
+    "Surtout le soir quand nous sommes fatigués",
+    "J'ai l'impression qu'il ne m'écoute pas",
+    "Je voudrais que nous parlions plus calmement",
+    "Oui, nous avons déjà essayé de faire des pauses",
+    "Ça marche parfois mais pas toujours",
+    "Je pense que nous avons besoin de plus de temps ensemble",
+    "Merci, c'est utile",
+]
+
+
+def rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # No /proc (macOS): fall back to the peak, in KiB on Linux and bytes on macOS
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def record(self, kind: str, seconds: float, ok: bool):
+        with self.lock:
+            self.latencies.setdefault(kind, []).append(seconds)
+            if not ok:
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    @contextlib.contextmanager
+    def timing(self, kind: str):
+        started = time.perf_counter()
+        outcome = {'ok': False}
+        try:
+            yield outcome
+        finally:
+            self.record(kind, time.perf_counter() - started, outcome['ok'])
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def latency_summary(values: List[float]) -> Dict:
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'max_ms': round(max(values) * 1000, 2),
+    }
+
+
+def flask_session(client, recorder: Recorder, stream: bool):
+    with recorder.timing('greeting') as outcome:
+        response = client.post('/api/chat', json={'message': json.dumps(CONTEXT), 'isInitialContext': True, 'stream': stream})
+        outcome['ok'] = response.status_code == 200
+    if not outcome['ok']:
+        return
+    conversation_id = (json.loads(response.data.splitlines()[-1]) if stream else response.json)['conversation_id']
+    for turn, message in enumerate(USER_MESSAGES, start=2):
+        kind = 'final' if turn == TURNS_PER_SESSION else 'turn'
+        with recorder.timing(kind) as outcome:
+            response = client.post('/api/chat', json={'message': message, 'conversation_id': conversation_id, 'stream': stream})
+            outcome['ok'] = response.status_code == 200 and b'"error"' not in response.data
+    with recorder.timing('stats') as outcome:
+        outcome['ok'] = client.get('/api/sessions/stats').status_code == 200
+
+
+def run_flask(args, model: FakeChatModel) -> Dict:
+    import api.index
+    import python_api.app as chat
+    from llm_client import usage_callback
+    from metrics import record_tokens
+
+    model.callbacks = [usage_callback(record_tokens)]
+    chat.llm = model
+    client = api.index.app.test_client()
+
+    def run_sessions(count: int, recorder: Recorder):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for future in [pool.submit(flask_session, client, recorder, args.stream) for _ in range(count)]:
+                future.result()
+
+    return measure(args, lambda count, recorder: run_sessions(count, recorder))
+
+
+async def fastapi_session(client, recorder: Recorder, session_id: str, stream: bool):
+    for turn, message in enumerate(USER_MESSAGES + ["Pouvez-vous résumer vos conseils ?"], start=1):
+        with recorder.timing('turn') as outcome:
+            response = await client.post('/chat', json={'message': message, 'session_id': session_id, 'stream': stream})
+            outcome['ok'] = response.status_code == 200 and '"error"' not in response.text
+    with recorder.timing('summary') as outcome:
+        outcome['ok'] = (await client.get(f'/summary/{session_id}')).status_code == 200
+    with recorder.timing('conversations') as outcome:
+        outcome['ok'] = (await client.get(f'/conversations/{session_id}', params={'limit': 100})).status_code == 200
+
+
+def run_fastapi(args, model: FakeChatModel) -> Dict:
+    os.environ.setdefault('SUPABASE_URL', 'http://localhost:54321')
+    os.environ.setdefault('SUPABASE_KEY', 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.bench')
+    import httpx
+    from langchain_core.output_parsers import StrOutputParser
+    import ai_setup
+    import api_handler
+    from python_api.llm_client import usage_callback
+    from python_api.metrics import record_tokens
+
+    model.callbacks = [usage_callback(record_tokens)]
+    ai_setup.llm = ai_setup.memory.llm = ai_setup.llm_chain.llm = model
+    ai_setup.reply_chain = ai_setup.prompt | model
+    for name in ('summary', 'update_summary', 'combine_summaries'):
+        setattr(ai_setup, f'{name}_chain', getattr(ai_setup, f'{name}_prompt') | model | StrOutputParser())
+    api_handler.supabase = FakeSupabase(latency=args.db_latency)
+    session_ids = itertools.count(1)
+
+    def run_sessions(count: int, recorder: Recorder):
+        async def main():
+            slots = asyncio.Semaphore(args.concurrency)
+            transport = httpx.ASGITransport(app=api_handler.app)
+            async with api_handler.lifespan(api_handler.app):
+                async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+                    async def one():
+                        async with slots:
+                            await fastapi_session(client, recorder, f'bench-{next(session_ids)}', args.stream)
+                    await asyncio.gather(*(one() for _ in range(count)))
+        asyncio.run(main())
+
+    return measure(args, run_sessions)
+
+
+def measure(args, run_sessions) -> Dict:
+    # One untimed session loads modules and fills caches, so RSS growth reflects the sessions only
+    run_sessions(1, Recorder())
+    gc.collect()
+    rss_before = rss_bytes()
+    recorder = Recorder()
+    started = time.perf_counter()
+    run_sessions(args.sessions, recorder)
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    rss_after = rss_bytes()
+
+    requests = sum(len(values) for values in recorder.latencies.values())
+    return {
+        'sessions': args.sessions,
+        'requests': requests,
+        'errors': sum(recorder.errors.values()),
+        'seconds': round(elapsed, 3),
+        'sessions_per_second': round(args.sessions / elapsed, 2),
+        'requests_per_second': round(requests / elapsed, 2),
+        'latency': {kind: latency_summary(values) for kind, values in sorted(recorder.latencies.items())},
+        'all_requests': latency_summary([v for values in recorder.latencies.values() for v in values]),
+        'rss_before_bytes': rss_before,
+        'rss_after_bytes': rss_after,
+        'rss_growth_per_session_bytes': round((rss_after - rss_before) / args.sessions),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_target(target: str, args) -> Dict:
+    if target in ('flask', 'fastapi') and args.target != target:
+        # Each app gets a fresh interpreter, so imports and RSS don't leak from one into the other
+        command = [sys.executable, __file__, '--target', target] + [
+            f'--{name.replace("_", "-")}={value}' for name, value in vars(args).items()
+            if name not in ('target', 'output', 'compare', 'stream')
+        ] + (['--stream'] if args.stream else [])
+        proc = subprocess.run(command, capture_output=True, text=True)
+        if proc.returncode != 0:
+            sys.stderr.write(proc.stderr)
+            raise SystemExit(f'{target} benchmark failed with status {proc.returncode}')
+        return json.loads(proc.stdout)['targets'][target]
+
+    model = FakeChatModel(latency=args.llm_latency, tokens_per_second=args.token_rate)
+    # The apps log every reply; keep that work but not the terminal output
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_flask(args, model) if target == 'flask' else run_fastapi(args, model)
+
+
+def compare(current: Dict, baseline: Dict) -> List[str]:
+    lines = []
+    for target, result in current['targets'].items():
+        before = baseline.get('targets', {}).get(target)
+        if not before:
+            continue
+        for label, now, then in (
+            ('requests/s', result['requests_per_second'], before['requests_per_second']),
+            ('p95 ms', result['all_requests']['p95_ms'], before['all_requests']['p95_ms']),
+            ('p99 ms', result['all_requests']['p99_ms'], before['all_requests']['p99_ms']),
+            ('RSS B/session', result['rss_growth_per_session_bytes'], before['rss_growth_per_session_bytes']),
+        ):
+            change = f'{(now - then) / then * 100:+.1f}%' if then else 'n/a'
+            lines.append(f'{target:8} {label:14} {then:>12} -> {now:>12}  {change}')
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', choices=TARGETS + ('both',), default='both')
+    parser.add_argument('--sessions', type=int, default=50, help='Sessions per target')
+    parser.add_argument('--concurrency', type=int, default=10, help='Sessions in flight at once')
+    parser.add_argument('--llm-latency', type=float, default=0.05, help='Fake model time to first token, seconds')
+    parser.add_argument('--token-rate', type=float, default=200, help='Fake model output tokens per second')
+    parser.add_argument('--db-latency', type=float, default=0.0, help='Fake Supabase latency per query, seconds')
+    parser.add_argument('--stream', action='store_true', help='Use the NDJSON streaming variant of the chat routes')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--compare', help='Previous JSON report to compare against')
+    args = parser.parse_args()
+
+    targets = TARGETS if args.target == 'both' else (args.target,)
+    report = {
+        'commit': git_commit(),
+        'config': {name: value for name, value in vars(args).items() if name not in ('output', 'compare')},
+        'targets': {target: run_target(target, args) for target in targets},
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            sys.stderr.write('\n'.join(compare(report, json.load(f))) + '\n')
+
+
+if __name__ == '__main__':
+    main()
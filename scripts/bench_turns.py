@@ -0,0 +1,149 @@
+"""Per-turn overhead of the chat path, old vs new.
+
+Compares, on an in-process fake chat model (no network, so only our own
+overhead is measured):
+
+* chain:    a ConversationBufferMemory + LLMChain(verbose=True) built for
+            every turn, as /api/chat used to do
+* executor: the shared, stateless TurnExecutor from python_api/turn_executor.py
+
+For each it reports wall time per turn (median and p95) and memory allocated
+per turn (tracemalloc, in a separate pass so tracing doesn't skew timings).
+
+    python scripts/bench_turns.py --turns 500 --history 20
+    python scripts/bench_turns.py --json > bench_turns.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'python_api')]
+
+from langchain.chains import LLMChain
+from langchain.memory import ConversationBufferMemory
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from history import SUMMARY_PREFIX
+from prompts import prompt, system_message
+from session_store import new_session
+from turn_executor import TurnExecutor, history_messages
+
+CONTEXT = {'topic': 'communication', 'partner1': 'Alex', 'partner2': 'Sam'}
+REPLY = "Je comprends. Pouvez-vous m'en dire plus sur ce qui s'est passé ?"
+
+
+def make_session(history: int):
+    session = new_session(CONTEXT)
+    for i in range(history):
+        session['messages'].append(['human', f"Message {i} de l'utilisateur sur notre couple"])
+        session['messages'].append(['ai', REPLY])
+    session['summary'] = 'Ils parlent de communication.'
+    return session
+
+
+def load_memory(memory, messages):
+    # Entries may carry a cached token count as a third element
+    for role, content, *_ in messages:
+        if role == 'human':
+            memory.chat_memory.add_user_message(content)
+        else:
+            memory.chat_memory.add_ai_message(content)
+    return memory
+
+
+def chain_turn(llm, session, input_message):
+    # The previous /api/chat path: memory and chain rebuilt around the shared model on every turn, called with predict
+    memory = ConversationBufferMemory(return_messages=True, input_key="input", memory_key="history")
+    if session.get('summary'):
+        memory.chat_memory.add_user_message(SUMMARY_PREFIX + session['summary'])
+    load_memory(memory, session['messages'])
+    chain = LLMChain(llm=llm, prompt=prompt, verbose=True, memory=memory)
+    return chain.predict(input=input_message, system=[system_message(session['context'])])
+
+
+def executor_turn(executor, session, input_message):
+    return executor.invoke(history_messages(session), session['context'], input_message)
+
+
+def measure(run, turns: int):
+    timings = []
+    # verbose=True chains print each prompt: keep that cost, but not the terminal's
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(turns):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for _ in range(turns):
+            run()
+        allocated = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename')
+                        if stat.size_diff > 0)
+        tracemalloc.stop()
+    timings.sort()
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 3),
+        'retained_bytes_per_turn': round(allocated / turns),
+    }
+
+
+def measure_allocations(run, turns: int):
+    # Total bytes allocated per turn, counting objects that were freed again
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        total = 0
+        for _ in range(turns):
+            tracemalloc.reset_peak()
+            start, _ = tracemalloc.get_traced_memory()
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - start
+        tracemalloc.stop()
+    return round(total / turns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=300, help='Turns per variant')
+    parser.add_argument('--history', type=int, default=10, help='Exchanges already in the session')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable results')
+    args = parser.parse_args()
+
+    llm = FakeListChatModel(responses=[REPLY])
+    session = make_session(args.history)
+    executor = TurnExecutor(lambda: llm)
+    variants = {
+        'chain': lambda: chain_turn(llm, session, 'Nous avons du mal à nous parler'),
+        'executor': lambda: executor_turn(executor, session, 'Nous avons du mal à nous parler'),
+    }
+    for run in variants.values():
+        run()  # Warm caches and lazy imports before measuring
+
+    results = {}
+    for name, run in variants.items():
+        results[name] = measure(run, args.turns)
+        results[name]['peak_bytes_per_turn'] = measure_allocations(run, args.turns)
+
+    if args.json:
+        print(json.dumps({'turns': args.turns, 'history': args.history, 'results': results}, indent=2))
+        return
+    print(f"{args.turns} turns, {args.history} exchanges of history, fake model")
+    print(f"{'':10} {'median ms':>10} {'p95 ms':>10} {'peak KiB/turn':>14} {'retained B/turn':>16}")
+    for name, result in results.items():
+        print(f"{name:10} {result['median_ms']:10.3f} {result['p95_ms']:10.3f} "
+              f"{result['peak_bytes_per_turn'] / 1024:14.1f} {result['retained_bytes_per_turn']:16}")
+    chain, executor = results['chain'], results['executor']
+    print(f"\nexecutor: {chain['median_ms'] / executor['median_ms']:.1f}x faster per turn, "
+          f"{chain['peak_bytes_per_turn'] / max(executor['peak_bytes_per_turn'], 1):.1f}x less allocated")
+
+
+if __name__ == '__main__':
+    main()
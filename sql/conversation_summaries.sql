@@ -0,0 +1,9 @@
+-- Stored session summaries for GET /summary/{session_id}.
+-- last_row_id is the id of the last conversations row folded into the summary;
+-- later calls only summarize rows with a greater id.
+create table if not exists conversation_summaries (
+    session_id text primary key,
+    summary text not null,
+    last_row_id bigint not null default 0,
+    updated_at timestamptz not null default now()
+);
@@ -0,0 +1,9 @@
+-- Index backing the keyset pagination of GET /conversations/{session_id},
+-- which filters on session_id and orders by (created_at, id).
+-- id is included as the tie-breaker for rows sharing a created_at.
+create index concurrently if not exists conversations_session_created_at_idx
+    on conversations (session_id, created_at, id);
+
+-- Index backing summarize_batch.py, which streams the whole table ordered by (session_id, id).
+create index concurrently if not exists conversations_session_id_idx
+    on conversations (session_id, id);
@@ -0,0 +1,137 @@
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ai_setup import acombine_summaries, aupdate_summary
+from write_behind import unseen
+
+# A stored summary is (summary, last_row_id): the summary covers every
+# conversations row of the session with id <= last_row_id.
+SummaryState = Tuple[str, int]
+
+
+def format_rows(rows: List[Dict]) -> str:
+    return "\n".join(f"User: {row['user_message']}\nAI: {row['ai_response']}" for row in rows)
+
+
+def chunk_rows(rows: List[Dict], chunk_chars: int) -> List[str]:
+    chunks, current, size = [], [], 0
+    for row in rows:
+        text = format_rows([row])
+        if current and size + len(text) > chunk_chars:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(text)
+        size += len(text)
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+class IncrementalSummaries:
+    """Session summaries that only ever fold in turns they haven't seen.
+
+    ``fetch_rows(session_id, after_id)`` returns the session's rows with
+    ``id > after_id`` ordered by id; ``load``/``save`` read and write the
+    stored (summary, last_row_id). Summaries are also kept in a small LRU so
+    repeated calls skip the summaries table, and concurrent calls for one
+    session share a single computation. Summaries that include rows not yet
+    persisted are cached too, for as long as the same rows are pending.
+    """
+
+    def __init__(self, fetch_rows: Callable[[str, int], Awaitable[List[Dict]]],
+                 load: Callable[[str], Awaitable[Optional[SummaryState]]],
+                 save: Callable[[str, str, int], Awaitable[None]],
+                 chunk_chars: int = 12000, max_parallel: int = 4, max_entries: int = 1000):
+        self.fetch_rows = fetch_rows
+        self.load = load
+        self.save = save
+        self.chunk_chars = chunk_chars
+        self.max_entries = max_entries
+        self.max_parallel = max_parallel
+        self._llm_slots: Optional[asyncio.Semaphore] = None
+        self._cache: "OrderedDict[str, SummaryState]" = OrderedDict()
+        self._pending_cache: "OrderedDict[str, Tuple[tuple, str]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    async def get(self, session_id: str, pending_rows: List[Dict] = ()) -> str:
+        """Return the session summary, including ``pending_rows`` not yet in the database.
+
+        ``pending_rows`` must be taken before calling: any of them that a flush
+        got into the database meanwhile come back from the fetch and are only
+        counted once.
+        """
+        if self._llm_slots is None:
+            # Created here rather than in __init__ so it binds to the server's event loop
+            self._llm_slots = asyncio.Semaphore(self.max_parallel)
+        task = self._in_flight.get(session_id)
+        if task is None:
+            task = asyncio.ensure_future(self._refresh(session_id))
+            self._in_flight[session_id] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(session_id, None))
+        summary, last_row_id, fetched = await asyncio.shield(task)
+        pending_rows = unseen(list(pending_rows), fetched)
+        if not pending_rows:
+            return summary
+        # Not persisted yet, so they can't move the high-water mark: fold them in, keyed by what is pending
+        key = (last_row_id,) + tuple((row["user_message"], row["ai_response"]) for row in pending_rows)
+        cached = self._pending_cache.get(session_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        summary = await self._fold(summary, pending_rows)
+        self._remember(self._pending_cache, session_id, (key, summary))
+        return summary
+
+    async def _refresh(self, session_id: str) -> Tuple[str, int, List[Dict]]:
+        # Also returns the rows fetched, which may overlap the caller's pending snapshot
+        state = self._cache.get(session_id)
+        if state is None:
+            state = await self.load(session_id) or ("", 0)
+        summary, last_row_id = state
+        rows = await self.fetch_rows(session_id, last_row_id)
+        if rows:
+            summary = await self._fold(summary, rows)
+            last_row_id = rows[-1]["id"]
+            await self.save(session_id, summary, last_row_id)
+        self._remember(self._cache, session_id, (summary, last_row_id))
+        return summary, last_row_id, rows
+
+    async def _fold(self, summary: str, rows: List[Dict]) -> str:
+        chunks = chunk_rows(rows, self.chunk_chars)
+        if len(chunks) == 1:
+            return await aupdate_summary(summary, chunks[0])
+        # Map-reduce for long stretches of new turns: summarize chunks in parallel, then combine
+        partials = await asyncio.gather(*(self._limited(aupdate_summary("", chunk)) for chunk in chunks))
+        return await self._reduce(([summary] if summary else []) + list(partials))
+
+    async def _reduce(self, summaries: List[str]) -> str:
+        # Combine in groups that fit one prompt until a single call can finish the job
+        while len(summaries) > 1 and sum(len(s) for s in summaries) > self.chunk_chars:
+            groups, current = [], []
+            for summary in summaries:
+                if len(current) >= 2 and sum(len(s) for s in current) + len(summary) > self.chunk_chars:
+                    groups.append(current)
+                    current = []
+                current.append(summary)
+            groups.append(current)
+            summaries = list(await asyncio.gather(*(
+                self._limited(acombine_summaries(group)) if len(group) > 1 else self._identity(group[0])
+                for group in groups
+            )))
+        if len(summaries) == 1:
+            return summaries[0]
+        return await acombine_summaries(summaries)
+
+    async def _limited(self, coroutine):
+        async with self._llm_slots:
+            return await coroutine
+
+    @staticmethod
+    async def _identity(value):
+        return value
+
+    def _remember(self, cache: OrderedDict, session_id: str, value):
+        cache[session_id] = value
+        cache.move_to_end(session_id)
+        while len(cache) > self.max_entries:
+            cache.popitem(last=False)
@@ -0,0 +1,300 @@
+"""Offline batch summarization and transcript export.
+
+    python summarize_batch.py summarize [--workers 8] [--rpm 50] [--checkpoint summarize.checkpoint.json]
+    python summarize_batch.py export transcripts.jsonl [--checkpoint export.checkpoint.json]
+
+Both commands stream the conversations table ordered by (session_id, id), so
+only one session's rows are held at a time, and record a checkpoint to resume
+from after a crash; the checkpoint is removed once a run gets to the end.
+``summarize`` only processes sessions with turns newer than their stored
+summary (conversation_summaries.last_row_id) and writes results back in bulk;
+``export`` writes one JSON line per session.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+Cursor = Tuple[str, int]
+
+
+class SupabaseConversationStore:
+    """Conversations and summaries in Supabase, read in keyset pages."""
+
+    def __init__(self, client, page_size: int = 1000):
+        self.client = client
+        self.page_size = page_size
+
+    def iter_rows(self, after: Optional[Cursor] = None) -> Iterator[Dict]:
+        while True:
+            query = self.client.table("conversations").select("id", "session_id", "user_message", "ai_response", "created_at")
+            if after:
+                session_id, row_id = after
+                query = query.or_(f'session_id.gt."{session_id}",and(session_id.eq."{session_id}",id.gt.{row_id})')
+            rows = query.order("session_id").order("id").limit(self.page_size).execute().data
+            yield from rows
+            if len(rows) < self.page_size:
+                return
+            after = (rows[-1]["session_id"], rows[-1]["id"])
+
+    def load_summary_states(self, session_ids: List[str]) -> Dict[str, Tuple[str, int]]:
+        result = (self.client.table("conversation_summaries").select("session_id", "summary", "last_row_id")
+                  .in_("session_id", session_ids).execute())
+        return {row["session_id"]: (row["summary"], row["last_row_id"]) for row in result.data}
+
+    def save_summaries(self, rows: List[Dict]):
+        self.client.table("conversation_summaries").upsert(rows).execute()
+
+
+def iter_sessions(rows: Iterator[Dict]) -> Iterator[Tuple[str, List[Dict]]]:
+    session_id, turns = None, []
+    for row in rows:
+        if row["session_id"] != session_id and turns:
+            yield session_id, turns
+            turns = []
+        session_id = row["session_id"]
+        turns.append(row)
+    if turns:
+        yield session_id, turns
+
+
+class RateLimiter:
+    """Token bucket shared by all workers: at most ``per_minute`` calls per minute."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Checkpoint:
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.state: Dict = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def save(self, **state):
+        self.state.update(state)
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        """Forget the position once a run has covered the whole table, so the next run starts from the top."""
+        self.state = {}
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def resume_cursor(checkpoint: Checkpoint) -> Optional[Cursor]:
+    # Rows are ordered by (session_id, id): start after the last id of the last finished session
+    session_id = checkpoint.state.get("session_id")
+    return (session_id, 2 ** 62) if session_id else None
+
+
+def summarize_all(store, summarize: Callable[[str, str], str], checkpoint: Checkpoint, workers: int = 8,
+                  per_minute: float = 0, lookup_batch: int = 100, write_batch: int = 100) -> Dict[str, int]:
+    """Summarize every session with unsummarized turns.
+
+    ``summarize(previous_summary, transcript)`` returns the new summary. At
+    most ``2 * workers`` sessions are held in memory at once, and only
+    sessions that are being summarized or waiting to be written are tracked
+    for the checkpoint, so memory stays flat however many sessions are
+    already up to date. The checkpoint only advances past a session once it
+    and every session before it have been written back, and never past a
+    session that failed, so a crashed run retries it. A run that gets
+    through the whole table clears the checkpoint. If writing summaries back
+    fails, no more sessions are started and the error is raised once the
+    running ones are done.
+    """
+    from summaries import format_rows
+
+    limiter = RateLimiter(per_minute)
+    stats = {"sessions": 0, "summarized": 0, "skipped": 0, "failed": 0}
+    slots = threading.BoundedSemaphore(workers * 2)
+    lock = threading.Lock()
+    # [session_id, done, ok, last up-to-date session after it] for sessions being summarized, in stream order
+    order: deque = deque()
+    results: List[Tuple[list, Dict]] = []  # (order entry, row) not written yet
+    watermark = {"session_id": None, "saved": None, "blocked": False}
+    write_errors: List[Exception] = []
+
+    def passed(session_id):
+        # Caller holds `lock`
+        if not watermark["blocked"]:
+            watermark["session_id"] = session_id
+
+    def advance():
+        # Caller holds `lock`
+        while order and order[0][1]:
+            session_id, _, ok, up_to_date = order.popleft()
+            if not ok:
+                watermark["blocked"] = True
+            passed(session_id)
+            if up_to_date:
+                passed(up_to_date)
+        if watermark["session_id"] != watermark["saved"]:
+            checkpoint.save(session_id=watermark["session_id"], **stats)
+            watermark["saved"] = watermark["session_id"]
+
+    def flush():
+        # Caller holds `lock`. Rows stay queued if the write fails, for the next flush to retry
+        if results:
+            store.save_summaries([row for _, row in results])
+            for entry, _ in results:
+                entry[1] = True
+            results.clear()
+        advance()
+
+    def work(entry, session_id, previous, turns):
+        try:
+            try:
+                limiter.acquire()
+                summary = summarize(previous, format_rows(turns))
+                row = {"session_id": session_id, "summary": summary, "last_row_id": turns[-1]["id"],
+                       "updated_at": datetime.now(timezone.utc).isoformat()}
+            except Exception as e:
+                print(f"Failed to summarize {session_id}: {str(e)}")
+                row = None
+            with lock:
+                if row:
+                    results.append((entry, row))
+                    stats["summarized"] += 1
+                else:
+                    entry[1], entry[2] = True, False
+                    stats["failed"] += 1
+                try:
+                    if len(results) >= write_batch:
+                        flush()
+                    else:
+                        advance()
+                except Exception as e:
+                    print(f"Failed to save {len(results)} summaries: {str(e)}")
+                    write_errors.append(e)
+        finally:
+            slots.release()
+
+    def submit(batch, executor):
+        states = store.load_summary_states([session_id for session_id, _ in batch])
+        for session_id, turns in batch:
+            previous, last_row_id = states.get(session_id, ("", 0))
+            new_turns = [turn for turn in turns if turn["id"] > last_row_id]
+            with lock:
+                stats["sessions"] += 1
+                if not new_turns:
+                    stats["skipped"] += 1
+                    # Up to date: it only needs to be passed by the watermark
+                    if order:
+                        order[-1][3] = session_id
+                    else:
+                        passed(session_id)
+                    continue
+                entry = [session_id, False, True, None]
+                order.append(entry)
+            slots.acquire()
+            if write_errors:
+                slots.release()
+                return False
+            executor.submit(work, entry, session_id, previous, new_turns)
+        with lock:
+            advance()
+        return True
+
+    complete = False
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        batch = []
+        for session in iter_sessions(store.iter_rows(resume_cursor(checkpoint))):
+            batch.append(session)
+            if len(batch) >= lookup_batch:
+                if not submit(batch, executor):
+                    break
+                batch = []
+        else:
+            complete = submit(batch, executor) if batch else not write_errors
+    with lock:
+        # Last try for rows whose earlier write failed; raises if the store is still failing
+        flush()
+        if write_errors:
+            raise write_errors[0]
+    if complete:
+        checkpoint.clear()
+    return stats
+
+
+def export_all(store, path: str, checkpoint: Checkpoint, flush_every: int = 1000) -> int:
+    """Write one JSON line per session: {"session_id", "turns": [[id, created_at, user_message, ai_response], ...]}."""
+    offset = checkpoint.state.get("offset", 0)
+    exported = 0
+    mode = "r+b" if offset and os.path.exists(path) else "wb"
+    with open(path, mode) as f:
+        # Drop anything written after the last checkpoint, it will be written again
+        f.seek(offset)
+        f.truncate()
+        for session_id, turns in iter_sessions(store.iter_rows(resume_cursor(checkpoint))):
+            line = {"session_id": session_id,
+                    "turns": [[t["id"], t["created_at"], t["user_message"], t["ai_response"]] for t in turns]}
+            f.write(json.dumps(line, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+            exported += 1
+            if exported % flush_every == 0:
+                f.flush()
+                os.fsync(f.fileno())
+                checkpoint.save(session_id=session_id, offset=f.tell())
+        f.flush()
+        os.fsync(f.fileno())
+    checkpoint.clear()
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch summarization and transcript export for Coopleo conversations")
+    commands = parser.add_subparsers(dest="command", required=True)
+    summarize_parser = commands.add_parser("summarize")
+    summarize_parser.add_argument("--workers", type=int, default=8)
+    summarize_parser.add_argument("--rpm", type=float, default=50, help="Max LLM calls per minute, 0 for no limit")
+    summarize_parser.add_argument("--write-batch", type=int, default=100)
+    summarize_parser.add_argument("--checkpoint", default="summarize.checkpoint.json")
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("output")
+    export_parser.add_argument("--checkpoint", default="export.checkpoint.json")
+    for command in (summarize_parser, export_parser):
+        command.add_argument("--page-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    from supabase import create_client
+    store = SupabaseConversationStore(
+        create_client(os.environ.get("SUPABASE_URL"), os.environ.get("SUPABASE_KEY")), page_size=args.page_size
+    )
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.command == "summarize":
+        from ai_setup import update_summary
+        stats = summarize_all(store, update_summary, checkpoint, workers=args.workers, per_minute=args.rpm,
+                              write_batch=args.write_batch)
+        print(f"Done: {stats}")
+    else:
+        print(f"Exported {export_all(store, args.output, checkpoint)} sessions to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
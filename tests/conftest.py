@@ -0,0 +1,11 @@
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# The same layout the apps run with: root modules, and python_api's modules importing each other by name
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'python_api')]
+
+# api_handler and ai_setup build their clients at import; nothing here reaches the network
+os.environ.setdefault('SUPABASE_URL', 'http://localhost:54321')
+os.environ.setdefault('SUPABASE_KEY', 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.test')
+os.environ.setdefault('ANTHROPIC_API_KEY', 'test')
@@ -0,0 +1,193 @@
+"""Fakes shared by the tests and scripts/bench_load.py: a chat model and an in-memory Supabase client.
+
+Neither needs network access or an API key.
+"""
+import asyncio
+import itertools
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+REPLY = ("Je comprends, Alex. Ce que vous décrivez est fréquent chez les couples fatigués en fin de journée. "
+         "Pouvez-vous me dire ce qui se passe juste avant que la dispute commence ?")
+SUGGESTIONS = "Je ne sais pas vraiment\nCela arrive surtout le soir\nNous avons essayé d'en parler"
+FINAL = ("Voici mes recommandations finales :\n• Prévoyez un moment calme chaque soir\n• Utilisez des phrases en « je »\n"
+         "• Faites une pause quand le ton monte\nVoulez-vous recevoir ces recommandations par email ?")
+SUMMARY = "Alex et Sam se disputent le soir ; ils veulent communiquer plus calmement et passer plus de temps ensemble."
+
+
+def message_text(message) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return ''.join(block.get('text', '') for block in message.content if isinstance(block, dict))
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic chat model: waits ``latency`` seconds, then emits ``tokens_per_second`` words per second.
+
+    The reply depends on what is asked (suggestions, final recommendations,
+    a summary or a plain turn) so the apps take their usual code paths.
+    """
+
+    latency: float = 0.05
+    tokens_per_second: float = 200.0
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake-coopleo'
+
+    def reply(self, messages) -> str:
+        text = message_text(messages[-1])
+        if 'Generate the 3 suggestions now' in text:
+            return SUGGESTIONS
+        if 'Provide final recommendations now' in text:
+            return FINAL
+        if "The user's message" in text or 'Greet the user' in text or 'Human:' in text:
+            return REPLY
+        return SUMMARY if 'summar' in text.lower() else REPLY
+
+    def usage(self, messages, reply: str) -> Dict:
+        input_tokens = sum(len(message_text(m)) for m in messages) // 4
+        output_tokens = len(reply.split())
+        return {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'total_tokens': input_tokens + output_tokens}
+
+    def duration(self, reply: str) -> float:
+        return self.latency + len(reply.split()) / self.tokens_per_second
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        reply = self.reply(messages)
+        time.sleep(self.duration(reply))
+        message = AIMessage(content=reply, usage_metadata=self.usage(messages, reply))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        reply = self.reply(messages)
+        await asyncio.sleep(self.duration(reply))
+        message = AIMessage(content=reply, usage_metadata=self.usage(messages, reply))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def chunks(self, messages) -> Iterator[AIMessageChunk]:
+        reply = self.reply(messages)
+        words = reply.split(' ')
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            yield AIMessageChunk(content=word if last else word + ' ',
+                                 usage_metadata=self.usage(messages, reply) if last else None)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency)
+        for chunk in self.chunks(messages):
+            time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for chunk in self.chunks(messages):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=chunk)
+
+
+class FakeSupabase:
+    """In-memory stand-in for the Supabase client calls made by api_handler.py."""
+
+    PRIMARY_KEYS = {'conversations': 'id', 'conversation_summaries': 'session_id'}
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.tables: Dict[str, List[Dict]] = {name: [] for name in self.PRIMARY_KEYS}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def table(self, name: str) -> 'FakeQuery':
+        return FakeQuery(self, name)
+
+
+class FakeQuery:
+    KEYSET = re.compile(r'^(\w+)\.gt\."(.*)",and\(\1\.eq\."(.*)",id\.gt\.(\d+)\)$')
+
+    def __init__(self, db: FakeSupabase, table: str):
+        self.db = db
+        self.table = table
+        self.rows: Optional[List[Dict]] = None
+        self.upserting = False
+        self.columns: tuple = ()
+        self.filters: List = []
+        self.ordering: List[str] = []
+        self.max_rows: Optional[int] = None
+
+    def insert(self, rows):
+        self.rows = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows):
+        self.upserting = True
+        return self.insert(rows)
+
+    def select(self, *columns):
+        self.columns = columns
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row[column] > value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def or_(self, expression: str):
+        # Only the keyset form used for pagination: a.gt."v",and(a.eq."v",id.gt.N)
+        column, after, _, row_id = self.KEYSET.match(expression).groups()
+        row_id = int(row_id)
+        self.filters.append(lambda row: row[column] > after or (row[column] == after and row['id'] > row_id))
+        return self
+
+    def order(self, column, desc=False):
+        self.ordering.append(column)
+        return self
+
+    def limit(self, count):
+        self.max_rows = count
+        return self
+
+    def execute(self):
+        if self.db.latency:
+            time.sleep(self.db.latency)
+        with self.db.lock:
+            table = self.db.tables[self.table]
+            if self.rows is not None:
+                return SimpleNamespace(data=self.write(table))
+            rows = [row for row in table if all(match(row) for match in self.filters)]
+        if self.ordering:
+            rows.sort(key=lambda row: tuple(row[column] for column in self.ordering))
+        if self.max_rows is not None:
+            rows = rows[:self.max_rows]
+        if self.columns and self.columns != ('*',):
+            rows = [{column: row.get(column) for column in self.columns} for row in rows]
+        return SimpleNamespace(data=rows)
+
+    def write(self, table: List[Dict]) -> List[Dict]:
+        key = self.db.PRIMARY_KEYS[self.table]
+        written = []
+        for row in self.rows:
+            row = dict(row)
+            if self.upserting:
+                table[:] = [existing for existing in table if existing.get(key) != row.get(key)]
+            else:
+                row.setdefault('id', next(self.db.ids))
+                row.setdefault('created_at', datetime.now(timezone.utc).isoformat())
+            table.append(row)
+            written.append(row)
+        return written
@@ -0,0 +1,51 @@
+"""The FastAPI handlers must not block the event loop: concurrent requests overlap their LLM waits."""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import ai_setup
+import api_handler
+from tests.support import FakeChatModel, FakeSupabase
+
+LLM_LATENCY = 0.5
+CONCURRENT_REQUESTS = 10
+
+
+@pytest.fixture
+def slow_llm(monkeypatch):
+    model = FakeChatModel(latency=LLM_LATENCY, tokens_per_second=100000)
+    monkeypatch.setattr(ai_setup.llm_chain, 'llm', model)
+    monkeypatch.setattr(ai_setup.memory, 'llm', model)
+    monkeypatch.setattr(ai_setup, 'reply_chain', ai_setup.prompt | model)
+    monkeypatch.setattr(api_handler, 'supabase', FakeSupabase())
+    return model
+
+
+async def post_concurrently(requests):
+    async with api_handler.lifespan(api_handler.app):
+        transport = httpx.ASGITransport(app=api_handler.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test', timeout=None) as client:
+            started = time.perf_counter()
+            responses = await asyncio.gather(*(client.post('/chat', json=body) for body in requests))
+            return responses, time.perf_counter() - started
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_concurrent_chats_take_about_one_llm_latency(slow_llm, stream):
+    requests = [{'message': 'Bonjour', 'session_id': f'session-{i}', 'stream': stream} for i in range(CONCURRENT_REQUESTS)]
+    responses, elapsed = asyncio.run(post_concurrently(requests))
+
+    assert [response.status_code for response in responses] == [200] * CONCURRENT_REQUESTS
+    assert all('"error"' not in response.text for response in responses)
+    # Run one after the other they would take CONCURRENT_REQUESTS * LLM_LATENCY
+    assert elapsed < LLM_LATENCY * 2
+
+
+def test_turns_are_persisted_on_shutdown(slow_llm):
+    requests = [{'message': 'Bonjour', 'session_id': f'session-{i}'} for i in range(3)]
+    asyncio.run(post_concurrently(requests))
+
+    rows = api_handler.supabase.tables['conversations']
+    assert sorted(row['session_id'] for row in rows) == ['session-0', 'session-1', 'session-2']
@@ -0,0 +1,153 @@
+"""WriteBehindQueue against the in-memory Supabase stand-in from tests/support.py."""
+import asyncio
+
+from tests.support import FakeSupabase
+from write_behind import WriteBehindQueue
+
+
+class Conversations:
+    """Async insert into a FakeSupabase table, failing the next ``failures`` calls."""
+
+    def __init__(self, failures: int = 0):
+        self.db = FakeSupabase()
+        self.failures = failures
+        self.batches = []
+
+    async def insert(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('database unavailable')
+        self.batches.append(len(rows))
+        self.db.table('conversations').insert(rows).execute()
+
+    def read(self, session_id):
+        return self.db.table('conversations').select('*').eq('session_id', session_id).order('id').execute().data
+
+
+def turn(session_id, number):
+    return {'session_id': session_id, 'user_message': f'question {number}', 'ai_response': f'answer {number}'}
+
+
+def queue(store, **kwargs):
+    options = {'batch_size': 3, 'flush_interval': 60, 'retry_delay': 0.001, 'max_retry_delay': 0.001}
+    return WriteBehindQueue(store.insert, **{**options, **kwargs})
+
+
+def test_flush_inserts_in_batches():
+    async def main():
+        store = Conversations()
+        rows = queue(store)
+        rows.start()
+        for number in range(7):
+            rows.enqueue(turn('s1', number))
+        await rows.flush()
+        await rows.close()
+        return store
+
+    store = asyncio.run(main())
+    assert store.batches == [3, 3, 1]
+    assert [row['user_message'] for row in store.read('s1')] == [f'question {number}' for number in range(7)]
+
+
+def test_full_batch_wakes_the_flusher():
+    async def main():
+        store = Conversations()
+        rows = queue(store)
+        for number in range(3):
+            rows.enqueue(turn('s1', number))
+        await asyncio.sleep(0.05)
+        flushed = rows.flushed
+        await rows.close()
+        return flushed
+
+    assert asyncio.run(main()) == 3
+
+
+def test_failed_inserts_are_retried():
+    async def main():
+        store = Conversations(failures=2)
+        rows = queue(store, max_retries=5)
+        rows.start()
+        rows.enqueue(turn('s1', 1))
+        await rows.flush()
+        await rows.close()
+        return store, rows
+
+    store, rows = asyncio.run(main())
+    assert len(store.read('s1')) == 1
+    assert rows.failed_batches == 0
+
+
+def test_batch_that_keeps_failing_stays_queued_and_readable():
+    async def main():
+        store = Conversations(failures=2)
+        rows = queue(store, max_retries=2)
+        rows.start()
+        rows.enqueue(turn('s1', 1))
+        await rows.flush()
+        pending = rows.pending('s1')
+        stored = store.read('s1')
+        await rows.flush()
+        await rows.close()
+        return store, rows, pending, stored
+
+    store, rows, pending, stored = asyncio.run(main())
+    assert rows.failed_batches == 1
+    assert stored == [] and [row['user_message'] for row in pending] == ['question 1']
+    assert [row['user_message'] for row in store.read('s1')] == ['question 1']
+
+
+def test_close_drains_the_queue():
+    async def main():
+        store = Conversations()
+        rows = queue(store, batch_size=50)
+        for number in range(5):
+            rows.enqueue(turn('s1', number))
+        await rows.close()
+        return store, rows
+
+    store, rows = asyncio.run(main())
+    assert len(store.read('s1')) == 5
+    assert rows.pending('s1') == []
+
+
+def test_merge_reads_your_writes_without_duplicates():
+    async def main():
+        store = Conversations()
+        rows = queue(store, batch_size=50)
+        rows.start()
+        for number in range(2):
+            rows.enqueue(turn('s1', number))
+        await rows.flush()
+        for number in range(2, 4):
+            rows.enqueue(turn('s1', number))
+        rows.enqueue(turn('s2', 0))
+        # Taken before the read, as the handlers do; the first two are already stored
+        pending = rows.pending('s1')
+        merged = rows.merge(pending, store.read('s1'))
+        # A flush that lands between taking `pending` and the read must not duplicate rows either
+        pending = rows.pending('s1')
+        await rows.flush()
+        merged_after_flush = rows.merge(pending, store.read('s1'))
+        await rows.close()
+        return merged, merged_after_flush
+
+    merged, merged_after_flush = asyncio.run(main())
+    expected = [f'question {number}' for number in range(4)]
+    assert [row['user_message'] for row in merged] == expected
+    assert [row['user_message'] for row in merged_after_flush] == expected
+
+
+def test_queue_is_bounded_during_an_outage():
+    async def main():
+        store = Conversations(failures=10 ** 6)
+        rows = queue(store, max_retries=1, max_queue_size=5)
+        rows.start()
+        for number in range(8):
+            rows.enqueue(turn('s1', number))
+            await rows.flush()
+        return [row['user_message'] for row in rows.pending('s1')], rows.dropped
+
+    pending, dropped = asyncio.run(main())
+    assert pending == [f'question {number}' for number in range(3, 8)]
+    assert dropped == 3
@@ -0,0 +1,130 @@
+import asyncio
+import random
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+def unseen(pending: List[Dict], rows: List[Dict]) -> List[Dict]:
+    """The ``pending`` rows that aren't in ``rows``, e.g. because a flush landed before ``rows`` were read."""
+    seen = Counter((row.get("user_message"), row.get("ai_response")) for row in rows)
+    result = []
+    for row in pending:
+        key = (row["user_message"], row["ai_response"])
+        if seen[key]:
+            seen[key] -= 1
+        else:
+            result.append(row)
+    return result
+
+
+class WriteBehindQueue:
+    """Buffers rows in memory and inserts them in batches off the request path.
+
+    A batch is flushed when ``batch_size`` rows are waiting or every
+    ``flush_interval`` seconds, whichever comes first. Failed inserts are
+    retried with exponential backoff; a batch that still fails goes back to
+    the front of the queue for the next flush. Rows stay visible through
+    ``pending`` until their insert has succeeded.
+
+    At most ``max_queue_size`` rows are held: during a long database outage
+    the oldest ones are dropped (and counted in ``dropped``) rather than
+    letting memory grow until the process is killed.
+    """
+
+    def __init__(self, insert_rows: Callable[[List[Dict]], Awaitable[None]], batch_size: int = 50,
+                 flush_interval: float = 0.5, max_retries: int = 5, retry_delay: float = 0.2, max_retry_delay: float = 5,
+                 max_queue_size: int = 10000):
+        self.insert_rows = insert_rows
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_queue_size = max_queue_size
+        self._queue: List[Dict] = []
+        self._in_flight: List[Dict] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._closing = False
+        self.flushed = 0
+        self.failed_batches = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def enqueue(self, row: Dict):
+        self.start()
+        self._queue.append(row)
+        self._drop_overflow()
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def pending(self, session_id: str) -> List[Dict]:
+        return [row for row in self._in_flight + self._queue if row["session_id"] == session_id]
+
+    def merge(self, pending: List[Dict], rows: List[Dict]) -> List[Dict]:
+        """Append ``pending`` rows (taken before ``rows`` were read) that the read didn't see yet."""
+        return list(rows) + unseen(pending, rows)
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._queue:
+                batch, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+                self._in_flight = batch
+                try:
+                    await self._insert_with_retry(batch)
+                    self.flushed += len(batch)
+                except Exception as e:
+                    self.failed_batches += 1
+                    print(f"Failed to persist {len(batch)} conversation rows, keeping them queued: {str(e)}")
+                    self._queue = batch + self._queue
+                    self._drop_overflow()
+                    return
+                finally:
+                    self._in_flight = []
+
+    async def close(self):
+        if self._task is None:
+            return
+        # Let the flusher finish its current batch, then drain what is left
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        if self._queue:
+            await self.flush()
+        if self._queue:
+            print(f"Dropping {len(self._queue)} conversation rows that could not be persisted on shutdown")
+
+    def _drop_overflow(self):
+        overflow = len(self._queue) - self.max_queue_size
+        if overflow > 0:
+            del self._queue[:overflow]
+            self.dropped += overflow
+            print(f"Write-behind queue is full, dropped the {overflow} oldest conversation rows ({self.dropped} so far)")
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def _insert_with_retry(self, batch: List[Dict]):
+        for attempt in range(self.max_retries):
+            try:
+                return await self.insert_rows(batch)
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    raise
+                delay = min(self.max_retry_delay, self.retry_delay * 2 ** attempt) * random.uniform(0.5, 1)
+                print(f"Insert attempt {attempt + 1} failed, retrying in {delay:.2f} seconds: {str(e)}")
+                await asyncio.sleep(delay)